@@ -1,13 +1,26 @@
 import os
+import time
 import logging
 import zipfile
 import shutil
+import unicodedata
 from datetime import datetime
-from flask import Flask, render_template, request, redirect, url_for, flash, send_from_directory, jsonify, session
+from urllib.parse import quote
+from flask import Flask, Response, g, render_template, request, redirect, url_for, flash, send_from_directory, send_file, jsonify, session, abort
+from werkzeug.exceptions import NotFound
 from werkzeug.utils import secure_filename
 from werkzeug.middleware.proxy_fix import ProxyFix
-from word_utils import processar_zip, inserir_conteudo_word, substituir_placeholders
+from word_utils import processar_zip, inserir_conteudo_word, substituir_placeholders, validar_zip, largura_exibicao_cm, ALTURA_IMAGEM_CM, ORDEM_PASTAS, POLITICAS_ORDENACAO
 from config_manager import config_manager
+from job_manager import job_manager, STATUS_DONE, STATUS_FAILED
+from upload_store import upload_store, OffsetInvalidoError
+from blob_cache import blob_cache
+from image_utils import EXTENSAO_MINIATURA
+from docx_streaming import caminho_parcial
+from output_store import output_store
+from ingestao_zip import ingestao_zip
+from metadados_imagem import metadados_arquivo
+from metrics import registry, BYTES, FALHAS, RELATORIOS_GERADOS, ESTAGIO_SEGUNDOS, REQUISICAO_SEGUNDOS
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
@@ -22,6 +35,17 @@ app.config['MAX_CONTENT_LENGTH'] = 500 * 1024 * 1024  # 500MB max file size
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['OUTPUT_FOLDER'] = 'output'
 app.config['MODELS_FOLDER'] = 'models'
+app.config['ZIP_STREAMING'] = True  # Read images straight from the ZIP instead of extracting it
+app.config['IMAGE_DPI'] = int(os.environ.get('IMAGE_DPI', 220))  # Resolution of embedded photos at 10 cm height
+app.config['IMAGE_JPEG_QUALITY'] = int(os.environ.get('IMAGE_JPEG_QUALITY', 85))
+app.config['IMAGE_WORKERS'] = int(os.environ.get('IMAGE_WORKERS', os.cpu_count() or 1))  # Image preparation processes
+app.config['THUMBNAIL_MAX_AGE'] = 24 * 60 * 60  # Browser cache lifetime of preview thumbnails
+app.config['DEDUP_IMAGES'] = True  # Drop repeated photos and flag near-duplicates on upload
+app.config['UPLOAD_MAX_SIZE'] = 500 * 1024 * 1024  # Total size of a chunked upload
+app.config['UPLOAD_CHUNK_SIZE'] = 8 * 1024 * 1024  # Chunk size suggested to the browser
+app.config['USE_X_SENDFILE'] = os.environ.get('DOWNLOAD_X_SENDFILE') == '1'  # Let a front server (mod_xsendfile, lighttpd) send reports
+app.config['DOWNLOAD_POLL_INTERVAL'] = 0.25  # Seconds between checks while streaming a report still being written
+app.config['DOWNLOAD_RETRY_AFTER'] = 2  # Seconds a client waits before asking again for a report not being saved yet
 
 # Ensure required directories exist
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
@@ -68,6 +92,22 @@ def allowed_file(filename):
     """Check if file extension is allowed"""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def carregar_manifesto():
+    """Load the server-side manifest of the upload referenced by the session"""
+    upload_id = session.get('upload_id')
+    if not upload_id:
+        return None
+    return upload_store.get(upload_id)
+
+def caminho_no_workspace(upload_id, caminho):
+    """Check that an extracted image path sent back by the browser belongs to the upload"""
+    workspace = os.path.realpath(upload_store.workspace_dir(upload_id))
+    return os.path.commonpath([workspace, os.path.realpath(caminho)]) == workspace
+
+def nome_relatorio(nome_projeto):
+    """File name of the generated report for a project"""
+    return f"RELATÓRIO FOTOGRÁFICO - {secure_filename(nome_projeto)} - LEVANTAMENTO PREVENTIVO.docx"
+
 def validate_form_data(form_data):
     """Validate required form fields based on configuration"""
     errors = []
@@ -87,6 +127,26 @@ def validate_form_data(form_data):
     
     return errors
 
+@app.before_request
+def iniciar_medicao():
+    """Start the latency measurement of the request"""
+    g.inicio_requisicao = time.perf_counter()
+
+@app.after_request
+def registrar_latencia(response):
+    """Record request latency by route pattern, keeping label cardinality bounded"""
+    inicio = g.pop('inicio_requisicao', None)
+    if inicio is not None:
+        rota = request.url_rule.rule if request.url_rule else 'desconhecida'
+        REQUISICAO_SEGUNDOS.observe(time.perf_counter() - inicio, metodo=request.method,
+                                    rota=rota, status=str(response.status_code))
+    return response
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus text exposition of this process' metrics"""
+    return Response(registry.exportar(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/')
 def index():
     """Main page with form"""
@@ -128,10 +188,17 @@ def configuracoes():
         except:
             pass
     
+    # Pastas conhecidas primeiro, depois as que já têm uma política configurada
+    ordenacao = config_manager.get_ordenacao()
+    pastas_ordenacao = ORDEM_PASTAS + [pasta for pasta in ordenacao['pastas'] if pasta not in ORDEM_PASTAS]
+    
     return render_template('config.html',
                          placeholders=placeholders,
                          section_icons=section_icons,
-                         last_updated=last_updated)
+                         last_updated=last_updated,
+                         ordenacao=ordenacao,
+                         pastas_ordenacao=pastas_ordenacao,
+                         politicas_ordenacao=POLITICAS_ORDENACAO)
 
 @app.route('/configuracoes/salvar', methods=['POST'])
 def salvar_configuracoes():
@@ -139,7 +206,8 @@ def salvar_configuracoes():
     try:
         form_data = request.form.to_dict()
         
-        # Processar dados do formulário
+        # Processar dados do formulário; nada é gravado se algum campo for inválido
+        alteracoes = {}
         for key, config in config_manager.config['placeholders'].items():
             field_type = form_data.get(f'type_{key}', config.get('type', 'variable'))
             label = form_data.get(f'label_{key}', config.get('label', ''))
@@ -150,10 +218,25 @@ def salvar_configuracoes():
                 flash(f'Valor fixo obrigatório para: {label}', 'error')
                 return redirect(url_for('configuracoes'))
             
-            # Atualizar configuração
-            config_manager.update_placeholder(key, field_type, value, label)
+            alteracoes[key] = (field_type, value, label)
+        
+        # Ordenação das fotos: política padrão e exceções por pasta ("" usa o padrão)
+        ordenacao = None
+        if 'ordenacao_padrao' in form_data:
+            ordenacao = {'padrao': form_data['ordenacao_padrao'], 'pastas': {}}
+            for pasta, politica in zip(request.form.getlist('ordenacao_pasta'),
+                                       request.form.getlist('ordenacao_politica')):
+                if pasta.strip() and politica:
+                    ordenacao['pastas'][pasta.strip()] = politica
+            if any(p not in POLITICAS_ORDENACAO for p in [ordenacao['padrao'], *ordenacao['pastas'].values()]):
+                flash('Política de ordenação inválida', 'error')
+                return redirect(url_for('configuracoes'))
         
-        flash('Configurações salvas com sucesso!', 'success')
+        # Atualizar configuração com uma única gravação
+        if config_manager.update_placeholders(alteracoes, ordenacao):
+            flash('Configurações salvas com sucesso!', 'success')
+        else:
+            flash('Erro ao salvar configurações', 'error')
         
     except Exception as e:
         flash(f'Erro ao salvar configurações: {str(e)}', 'error')
@@ -166,8 +249,7 @@ def reset_configuracoes():
     """Restaura configurações padrão"""
     try:
         # Recriar configuração padrão
-        config_manager.config = config_manager.default_config.copy()
-        config_manager.save_config()
+        config_manager.reset()
         flash('Configurações restauradas para o padrão!', 'success')
     except Exception as e:
         flash(f'Erro ao restaurar configurações: {str(e)}', 'error')
@@ -177,16 +259,18 @@ def reset_configuracoes():
 @app.route('/preview')
 def preview():
     """Preview page showing folder structure and images before generating report"""
-    if 'conteudo_estruturado' not in session:
+    manifesto = carregar_manifesto()
+    if manifesto is None:
         flash('Dados não encontrados. Por favor, faça o upload novamente.', 'error')
         return redirect(url_for('index'))
     
-    conteudo_estruturado = session['conteudo_estruturado']
-    form_data = session['form_data']
+    conteudo_estruturado = manifesto['conteudo_estruturado']
+    form_data = manifesto['form_data']
     
     # Organize content for preview
     preview_items = []
     current_folder = None
+    arquivos_zip = {}  # Archives opened to read image headers, closed below
     
     for item in conteudo_estruturado:
         if isinstance(item, str):
@@ -209,31 +293,79 @@ def preview():
             # This is an image
             if current_folder:
                 image_name = os.path.basename(item['imagem'])
+                # Header only: pixel size and the size the photo will have in the report
+                if item.get('zip_path'):
+                    metadados = metadados_arquivo(item['zip_path'], item['imagem'], arquivos_zip)
+                else:
+                    metadados = metadados_arquivo(item['imagem'])
+                largura, altura = metadados.tamanho_exibido if metadados else (None, None)
                 current_folder['images'].append({
                     'type': 'image',
                     'name': image_name,
-                    'path': item['imagem']
+                    'path': item['imagem'],
+                    'thumb': item.get('miniatura'),
+                    'erro': item.get('erro'),
+                    'duplicatas': len(item.get('duplicatas', [])),
+                    'semelhante_a': os.path.basename(item['semelhante_a']) if item.get('semelhante_a') else None,
+                    'largura': largura,
+                    'altura': altura,
+                    'largura_cm': largura_exibicao_cm(largura, altura) if metadados else None
                 })
         elif isinstance(item, dict) and 'quebra_pagina' in item:
             # Skip page breaks in preview
             continue
     
+    for zip_ref in arquivos_zip.values():
+        zip_ref.close()
+    
     return render_template('preview.html', 
                          preview_items=preview_items,
-                         form_data=form_data)
+                         form_data=form_data,
+                         upload_id=session['upload_id'],
+                         altura_imagem_cm=ALTURA_IMAGEM_CM)
+
+@app.route('/thumb/<upload_id>/<int:n>')
+def thumb(upload_id, n):
+    """Serve a preview thumbnail; thumbnails never change, so browsers may cache them"""
+    try:
+        pasta_miniaturas = os.path.join(upload_store.upload_dir(upload_id), 'thumbs')
+    except ValueError:
+        abort(404)
+    
+    caminho = os.path.join(pasta_miniaturas, f"{n}{EXTENSAO_MINIATURA}")
+    if not os.path.exists(caminho):
+        abort(404)
+    
+    response = send_file(caminho, conditional=True, etag=True, max_age=app.config['THUMBNAIL_MAX_AGE'])
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.immutable = True
+    return response
 
 @app.route('/generate-report', methods=['POST'])
 def generate_report():
-    """Generate the final report with customized order"""
-    if 'form_data' not in session:
-        flash('Dados não encontrados. Por favor, faça o upload novamente.', 'error')
-        return redirect(url_for('index'))
+    """Queue generation of the final report with customized order"""
+    manifesto = carregar_manifesto()
+    if manifesto is None:
+        return jsonify({
+            'error': 'Dados não encontrados. Por favor, faça o upload novamente.',
+            'redirect': url_for('index')
+        }), 400
     
     try:
-        # Get data from session
-        form_data = session['form_data']
-        zip_path = session['zip_path']
-        modelo_path = session['modelo_path']
+        # Get data from the upload manifest
+        upload_id = session['upload_id']
+        form_data = manifesto['form_data']
+        zip_path = manifesto['zip_path']
+        modelo_path = manifesto['modelo_path']
+        zip_streaming = manifesto.get('zip_streaming', False)
+        
+        # Content hashes let identical photos be prepared only once
+        hashes = {
+            item['imagem']: item['sha256']
+            for item in manifesto['conteudo_estruturado']
+            if isinstance(item, dict) and item.get('sha256')
+        }
         
         # Get customized order from form
         customized_content = []
@@ -263,7 +395,17 @@ def generate_report():
                 
             elif item_type == 'image':
                 image_path = form_data_from_request[f'item_path_{i}']
-                customized_content.append({"imagem": image_path})
+                image_item = None
+                if zip_streaming:
+                    # Streaming items reference a member of the uploaded ZIP
+                    image_item = {"imagem": image_path, "zip_path": zip_path}
+                elif caminho_no_workspace(upload_id, image_path):
+                    image_item = {"imagem": image_path}
+                
+                if image_item:
+                    if image_path in hashes:
+                        image_item["sha256"] = hashes[image_path]
+                    customized_content.append(image_item)
             
             i += 1
         
@@ -292,40 +434,156 @@ def generate_report():
 
         # Generate output filename
         nome_projeto = form_data['nome_projeto']
-        safe_project_name = secure_filename(nome_projeto)
-        output_filename = f"RELATÓRIO FOTOGRÁFICO - {safe_project_name} - LEVANTAMENTO PREVENTIVO.docx"
-        output_path = os.path.join(app.config['OUTPUT_FOLDER'], output_filename)
-
-        # Generate Word document
-        app.logger.info(f"Generating Word document: {output_path}")
-        num_imagens = inserir_conteudo_word(modelo_path, final_content, PLACEHOLDERS, complete_form_data, output_path)
-
-        # Clean up temporary files
-        if os.path.exists(zip_path):
-            os.remove(zip_path)
-
-        # Clear session data
-        session.pop('form_data', None)
-        session.pop('zip_path', None)
-        session.pop('conteudo_estruturado', None)
-        session.pop('modelo_path', None)
-
-        # Success message
-        flash(f'Relatório gerado com sucesso! {num_imagens} imagens inseridas.', 'success')
-
-        return render_template('success.html', 
-                             filename=output_filename,
-                             num_imagens=num_imagens,
-                             projeto=nome_projeto)
+        output_path = output_store.unique_path(nome_relatorio(nome_projeto))
+
+        # Queue Word document generation
+        total_imagens = sum(1 for item in final_content if isinstance(item, dict) and 'imagem' in item)
+        job = job_manager.submit(
+            executar_geracao,
+            modelo_path, final_content, complete_form_data, output_path, upload_id, nome_projeto,
+            total=total_imagens, saida=output_path
+        )
+        app.logger.info(f"Queued report generation job {job.id}: {output_path}")
+
+        return jsonify({
+            'job_id': job.id,
+            'status_url': url_for('job_status', job_id=job.id),
+            'result_url': url_for('job_result', job_id=job.id),
+            'download_url': url_for('job_download', job_id=job.id)
+        }), 202
 
     except Exception as e:
         app.logger.error(f"Error generating report: {str(e)}")
-        flash(f'Erro ao gerar relatório: {str(e)}', 'error')
+        return jsonify({'error': f'Erro ao gerar relatório: {str(e)}'}), 500
+
+def executar_geracao(modelo_path, conteudo, form_data, output_path, upload_id, nome_projeto, progresso=None):
+    """Generate the Word document in a background job"""
+    with ESTAGIO_SEGUNDOS.time(estagio='relatorio_total'):
+        num_imagens = inserir_conteudo_word(modelo_path, conteudo, PLACEHOLDERS, form_data, output_path,
+                                            progresso=progresso,
+                                            dpi=app.config['IMAGE_DPI'],
+                                            qualidade_jpeg=app.config['IMAGE_JPEG_QUALITY'],
+                                            workers=app.config['IMAGE_WORKERS'],
+                                            cache=blob_cache,
+                                            pasta_trabalho=upload_store.workspace_dir(upload_id))
+    RELATORIOS_GERADOS.inc()
+    output_store.register(output_path, projeto=nome_projeto,
+                           modelo=os.path.splitext(os.path.basename(modelo_path))[0],
+                           imagens=num_imagens)
+
+    # Clean up the uploaded ZIP and its manifest
+    upload_store.delete(upload_id)
+
+    return {
+        'filename': os.path.basename(output_path),
+        'num_imagens': num_imagens,
+        'projeto': nome_projeto
+    }
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """Report generation progress as JSON"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Tarefa não encontrada'}), 404
+    
+    status = job.to_dict()
+    if job.status == STATUS_DONE:
+        status['result_url'] = url_for('job_result', job_id=job.id)
+    return jsonify(status)
+
+@app.route('/jobs/<job_id>/resultado')
+def job_result(job_id):
+    """Success page for a finished generation job"""
+    job = job_manager.get(job_id)
+    if job is None:
+        flash('Tarefa não encontrada', 'error')
+        return redirect(url_for('index'))
+    
+    if job.status == STATUS_FAILED:
+        flash(f'Erro ao gerar relatório: {job.error}', 'error')
         return redirect(url_for('preview'))
+    
+    if job.status != STATUS_DONE:
+        flash('O relatório ainda está sendo gerado', 'error')
+        return redirect(url_for('preview'))
+    
+    # Clear session data only once the report exists, so failures can be retried
+    session.pop('upload_id', None)
+    
+    # Success message
+    flash(f'Relatório gerado com sucesso! {job.result["num_imagens"]} imagens inseridas.', 'success')
+    
+    return render_template('success.html', 
+                         filename=job.result['filename'],
+                         num_imagens=job.result['num_imagens'],
+                         projeto=job.result['projeto'],
+                         horas_retencao=round(output_store.max_idade.total_seconds() / 3600))
+
+@app.route('/relatorios')
+def relatorios():
+    """List the generated reports still kept on the server"""
+    return render_template('relatorios.html',
+                         relatorios=output_store.list(),
+                         tamanho_total=output_store.disk_usage(),
+                         horas_retencao=round(output_store.max_idade.total_seconds() / 3600))
+
+def analisar_upload(upload_id, zip_path, form_data, previas=None):
+    """
+    Validate a received ZIP, build its content structure and thumbnails and
+    store the upload manifest; shared by the direct and the chunked upload
+    previas are image analyses already made while the ZIP was being received
+    Returns an error message, or None when the upload is ready for preview
+    """
+    BYTES.inc(os.path.getsize(zip_path), tipo='zip_recebido')
+
+    # Validate ZIP structure; member CRCs are checked while images are read
+    try:
+        validar_zip(zip_path)
+    except zipfile.BadZipFile as e:
+        return f'Arquivo ZIP corrompido ou inválido: {e}'
+
+    # Get selected model path
+    modelo_selecionado = form_data['modelo_selecionado']
+    modelo_path = os.path.join(app.config['MODELS_FOLDER'], f"{modelo_selecionado}.docx")
+
+    if not os.path.exists(modelo_path):
+        return f'Modelo não encontrado: {modelo_selecionado}'
+
+    # Process ZIP file
+    app.logger.info(f"Processing ZIP file: {zip_path}")
+    zip_streaming = app.config['ZIP_STREAMING']
+    pasta_miniaturas = os.path.join(upload_store.upload_dir(upload_id), 'thumbs')
+    conteudo_estruturado = processar_zip(zip_path, form_data, streaming=zip_streaming,
+                                         pasta_miniaturas=pasta_miniaturas,
+                                         workers=app.config['IMAGE_WORKERS'],
+                                         pasta_trabalho=upload_store.workspace_dir(upload_id),
+                                         deduplicar=app.config['DEDUP_IMAGES'],
+                                         cache=blob_cache,
+                                         previas=previas,
+                                         ordenacao=config_manager.get_ordenacao())
+
+    # Keep upload data on the server; the session only carries its ID
+    upload_store.save(upload_id, {
+        'form_data': form_data,
+        'zip_path': zip_path,
+        'conteudo_estruturado': conteudo_estruturado,
+        'modelo_path': modelo_path,
+        'zip_streaming': zip_streaming
+    })
+    session['upload_id'] = upload_id
+    return None
+
+def nome_zip_enviado(upload_id, filename):
+    """Path where an uploaded ZIP is kept inside its upload directory"""
+    filename = secure_filename(filename or 'arquivo.zip')
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    return os.path.join(upload_store.upload_dir(upload_id), f"{timestamp}_{filename}")
 
 @app.route('/upload', methods=['POST'])
 def processar_upload():
     """Process form submission and ZIP file upload"""
+    upload_id = None
     try:
         # Validate form data
         form_data = request.form.to_dict()
@@ -350,55 +608,235 @@ def processar_upload():
             flash('Apenas arquivos ZIP são permitidos', 'error')
             return redirect(url_for('index'))
 
-        # Save uploaded file
-        filename = secure_filename(file.filename or 'arquivo.zip')
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        safe_filename = f"{timestamp}_{filename}"
-        zip_path = os.path.join(app.config['UPLOAD_FOLDER'], safe_filename)
-        file.save(zip_path)
-
-        # Validate ZIP file
-        try:
-            with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-                zip_ref.testzip()
-        except zipfile.BadZipFile:
-            flash('Arquivo ZIP corrompido ou inválido', 'error')
-            os.remove(zip_path)
+        if not upload_store.has_space(request.content_length or 0):
+            flash('Espaço em disco insuficiente no servidor. Tente novamente mais tarde.', 'error')
             return redirect(url_for('index'))
 
-        # Get selected model path
-        modelo_selecionado = form_data['modelo_selecionado']
-        modelo_path = os.path.join(app.config['MODELS_FOLDER'], f"{modelo_selecionado}.docx")
+        # Save uploaded file in its own upload directory
+        upload_id = upload_store.create()
+        zip_path = nome_zip_enviado(upload_id, file.filename)
+        file.save(zip_path)
 
-        if not os.path.exists(modelo_path):
-            flash(f'Modelo não encontrado: {modelo_selecionado}', 'error')
-            os.remove(zip_path)
+        erro = analisar_upload(upload_id, zip_path, form_data)
+        if erro:
+            FALHAS.inc(etapa='upload')
+            flash(erro, 'error')
+            upload_store.delete(upload_id)
             return redirect(url_for('index'))
 
-        # Process ZIP file
-        app.logger.info(f"Processing ZIP file: {zip_path}")
-        conteudo_estruturado = processar_zip(zip_path, form_data)
-
-        # Store data in session for preview page
-        session['form_data'] = form_data
-        session['zip_path'] = zip_path
-        session['conteudo_estruturado'] = conteudo_estruturado
-        session['modelo_path'] = modelo_path
-
         # Redirect to preview page
         return redirect(url_for('preview'))
 
     except Exception as e:
         app.logger.error(f"Error processing upload: {str(e)}")
+        FALHAS.inc(etapa='upload')
         flash(f'Erro ao processar arquivo: {str(e)}', 'error')
+        if upload_id:
+            upload_store.delete(upload_id)
         return redirect(url_for('index'))
 
+@app.route('/upload/chunks', methods=['POST'])
+def iniciar_upload_partes():
+    """Start a chunked upload; the form fields are validated before any byte is sent"""
+    form_data = request.form.to_dict()
+    nome = form_data.pop('filename', '')
+    try:
+        tamanho = int(form_data.pop('size', ''))
+    except ValueError:
+        return jsonify({'error': 'Tamanho do arquivo inválido'}), 400
+
+    errors = validate_form_data(form_data)
+    if not allowed_file(nome):
+        errors.append('Apenas arquivos ZIP são permitidos')
+    if tamanho <= 0 or tamanho > app.config['UPLOAD_MAX_SIZE']:
+        errors.append('Arquivo muito grande. Tamanho máximo: 500MB' if tamanho > 0 else 'Arquivo ZIP vazio')
+    if errors:
+        return jsonify({'error': '; '.join(errors)}), 400
+
+    if not upload_store.has_space(tamanho):
+        return jsonify({'error': 'Espaço em disco insuficiente no servidor. Tente novamente mais tarde.'}), 507
+
+    upload_id = upload_store.create()
+    upload_store.save(upload_id, {
+        'form_data': form_data,
+        'zip_path': nome_zip_enviado(upload_id, nome),
+        'tamanho': tamanho,
+        'recebendo': True
+    })
+    return jsonify({
+        'upload_id': upload_id,
+        'offset': 0,
+        'size': tamanho,
+        'chunk_size': app.config['UPLOAD_CHUNK_SIZE'],
+        'chunk_url': url_for('enviar_parte', upload_id=upload_id),
+        'finalize_url': url_for('finalizar_upload_partes', upload_id=upload_id)
+    }), 201
+
+def carregar_upload_partes(upload_id):
+    """Load the manifest of a chunked upload still receiving data, or abort with 404"""
+    try:
+        manifesto = upload_store.get(upload_id)
+    except ValueError:
+        abort(404)
+    if not manifesto or not manifesto.get('recebendo'):
+        abort(404)
+    return manifesto
+
+@app.route('/upload/chunks/<upload_id>', methods=['GET'])
+def estado_upload_partes(upload_id):
+    """Report how many bytes were received, so an interrupted upload can resume"""
+    manifesto = carregar_upload_partes(upload_id)
+    return jsonify({
+        'upload_id': upload_id,
+        'offset': upload_store.received_bytes(upload_id),
+        'size': manifesto['tamanho']
+    })
+
+@app.route('/upload/chunks/<upload_id>', methods=['PUT'])
+def enviar_parte(upload_id):
+    """
+    Append the request body at the offset given by the Upload-Offset header
+    The body is copied to disk in small blocks, so memory use stays constant
+    """
+    manifesto = carregar_upload_partes(upload_id)
+    offset = request.headers.get('Upload-Offset', type=int)
+    if offset is None:
+        return jsonify({'error': 'Cabeçalho Upload-Offset ausente'}), 400
+
+    try:
+        offset = upload_store.append_chunk(upload_id, offset, request.stream, manifesto['tamanho'])
+    except OffsetInvalidoError as e:
+        return jsonify({'error': 'Offset inválido', 'offset': e.offset_atual}), 409
+
+    # Start on the images that are already complete while the next chunk is sent
+    try:
+        ingestao_zip.avancar(upload_id)
+    except Exception as e:
+        app.logger.warning(f"Incremental ZIP analysis stopped for upload {upload_id}: {e}")
+
+    return jsonify({'upload_id': upload_id, 'offset': offset, 'size': manifesto['tamanho']})
+
+@app.route('/upload/chunks/<upload_id>/finalizar', methods=['POST'])
+def finalizar_upload_partes(upload_id):
+    """Process a completely received chunked upload and open its preview"""
+    manifesto = carregar_upload_partes(upload_id)
+    recebidos = upload_store.received_bytes(upload_id)
+    if recebidos != manifesto['tamanho']:
+        return jsonify({'error': 'Upload incompleto', 'offset': recebidos}), 409
+
+    # Fields may have been edited while the file was being sent
+    form_data = request.form.to_dict() or manifesto['form_data']
+    errors = validate_form_data(form_data)
+    if errors:
+        return jsonify({'error': '; '.join(errors)}), 400
+
+    try:
+        # Images analyzed while the chunks arrived are not read again
+        ingestao_zip.aguardar(upload_id)
+        zip_path = manifesto['zip_path']
+        os.replace(upload_store.partial_path(upload_id), zip_path)
+        erro = analisar_upload(upload_id, zip_path, form_data, previas=ingestao_zip.resultados(upload_id))
+        ingestao_zip.descartar(upload_id)
+    except Exception as e:
+        app.logger.error(f"Error processing upload: {str(e)}")
+        erro = f'Erro ao processar arquivo: {str(e)}'
+
+    if erro:
+        FALHAS.inc(etapa='upload')
+        upload_store.delete(upload_id)
+        return jsonify({'error': erro}), 400
+    return jsonify({'redirect': url_for('preview')})
+
+@app.route('/jobs/<job_id>/download')
+def job_download(job_id):
+    """
+    Download the report of a job, starting while it is still being written
+    Before the job starts saving there is nothing to send: the reply is 202
+    with Retry-After instead of holding a worker. Once the job is done this
+    is a plain (resumable) download
+    Tail-following the file holds a thread until the job ends, so the server
+    must run threaded (gunicorn --threads) or async workers
+    """
+    job = job_manager.get(job_id)
+    if job is None or job.saida is None:
+        return jsonify({'error': 'Tarefa não encontrada'}), 404
+    if job.status == STATUS_FAILED:
+        return jsonify({'error': f'Erro ao gerar relatório: {job.error}'}), 409
+    
+    try:
+        arquivo = None if job.status == STATUS_DONE else open(caminho_parcial(job.saida), 'rb')
+    except FileNotFoundError:
+        # Queued or still preparing images; or just renamed, if the job finished meanwhile
+        job = job_manager.get(job_id) or job
+        if job.status != STATUS_DONE:
+            response = jsonify(job.to_dict())
+            response.status_code = 202
+            response.headers['Retry-After'] = str(app.config['DOWNLOAD_RETRY_AFTER'])
+            return response
+    if job.status == STATUS_DONE:
+        return redirect(url_for('download_file', filename=os.path.basename(job.saida)))
+    
+    # Size is unknown until the job ends: no Content-Length, no ranges
+    response = Response(acompanhar_escrita(job, arquivo),
+                        mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document')
+    response.call_on_close(arquivo.close)
+    cabecalho_anexo(response, os.path.basename(job.saida))
+    response.headers['Cache-Control'] = 'no-store'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+def acompanhar_escrita(job, arquivo, tamanho_bloco=256 * 1024):
+    """
+    Yield the bytes of the job's partial file as they are written, until it finishes
+    The report is written append-only to its partial file and renamed when
+    complete; the open file keeps being read across the rename. The job is
+    read again only after catching up with the writer, once per poll
+    interval. A failed job aborts the response, so the client never
+    mistakes it for a whole file.
+    """
+    intervalo = app.config['DOWNLOAD_POLL_INTERVAL']
+    terminada = False
+    with arquivo:
+        while True:
+            bloco = arquivo.read(tamanho_bloco)
+            if bloco:
+                yield bloco
+                continue
+            if terminada:
+                return
+            # Caught up: check the job, then read whatever was written meanwhile
+            job = job_manager.get(job.id) or job  # Jobs of other workers are read again from the database
+            if job.status == STATUS_FAILED:
+                raise RuntimeError(f"Report generation failed: {job.error}")
+            terminada = job.status == STATUS_DONE
+            if not terminada:
+                time.sleep(intervalo)
+
+def cabecalho_anexo(response, nome):
+    """Content-Disposition attachment header, with an RFC 5987 name when not ASCII"""
+    try:
+        nome.encode('ascii')
+        opcoes = {'filename': nome}
+    except UnicodeEncodeError:
+        simples = unicodedata.normalize('NFKD', nome).encode('ascii', 'ignore').decode('ascii')
+        opcoes = {'filename': simples, 'filename*': f"UTF-8''{quote(nome, safe='')}"}
+    response.headers.set('Content-Disposition', 'attachment', **opcoes)
+
 @app.route('/download/<filename>')
 def download_file(filename):
-    """Download generated report"""
+    """
+    Download generated report
+    Supports Range requests, so an interrupted download resumes where it
+    stopped, and ETag/Last-Modified revalidation with max_age=0, so a browser
+    never serves a cached copy of a file that was since removed or replaced
+    """
+    if output_store.get(filename) is None:
+        flash('Arquivo não encontrado', 'error')
+        return redirect(url_for('index'))
     try:
-        return send_from_directory(app.config['OUTPUT_FOLDER'], filename, as_attachment=True)
-    except FileNotFoundError:
+        return send_from_directory(output_store.base_dir, filename, as_attachment=True,
+                                   conditional=True, etag=True, max_age=0)
+    except (FileNotFoundError, NotFound):
         flash('Arquivo não encontrado', 'error')
         return redirect(url_for('index'))
 
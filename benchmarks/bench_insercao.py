@@ -0,0 +1,80 @@
+"""
+Benchmark of the Word assembly engine (inserir_conteudo_word)
+
+Generates N small distinct JPEGs inside a ZIP, builds the conteudo list the
+way processar_zip does and times document generation for each size.
+With linear assembly the time per image stays roughly constant.
+
+Usage: python benchmarks/bench_insercao.py [--tamanhos 100,250,500,1000,2000]
+"""
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+import zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image
+from word_utils import inserir_conteudo_word
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODELO_PADRAO = os.path.join(RAIZ, 'models', 'modelo_3575.docx')
+IMAGENS_POR_PASTA = 50
+
+def gerar_zip(zip_path, quantidade):
+    """Write quantidade distinct 64x48 JPEGs to a ZIP"""
+    with zipfile.ZipFile(zip_path, 'w') as zip_ref:
+        for i in range(quantidade):
+            cor = (i % 256, (i // 256) % 256, (i * 7) % 256)
+            buffer = io.BytesIO()
+            Image.new('RGB', (64, 48), cor).save(buffer, 'JPEG')
+            zip_ref.writestr(f'IMG_{i:05d}.jpg', buffer.getvalue())
+
+def montar_conteudo(zip_path, quantidade):
+    """Build a conteudo list with a folder title every IMAGENS_POR_PASTA images"""
+    conteudo = []
+    for i in range(quantidade):
+        if i % IMAGENS_POR_PASTA == 0:
+            if conteudo:
+                conteudo.append({"quebra_pagina": True})
+            conteudo.append(f"- Pasta {i // IMAGENS_POR_PASTA + 1}")
+        conteudo.append({"imagem": f'IMG_{i:05d}.jpg', "zip_path": zip_path})
+    conteudo.append({"quebra_pagina": True})
+    return conteudo
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tamanhos', default='100,250,500,1000,2000',
+                        help='Comma separated image counts')
+    parser.add_argument('--modelo', default=MODELO_PADRAO, help='Word template')
+    args = parser.parse_args()
+    tamanhos = [int(t) for t in args.tamanhos.split(',')]
+
+    resultados = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for quantidade in tamanhos:
+            zip_path = os.path.join(temp_dir, f'fotos_{quantidade}.zip')
+            output_path = os.path.join(temp_dir, f'relatorio_{quantidade}.docx')
+            gerar_zip(zip_path, quantidade)
+            conteudo = montar_conteudo(zip_path, quantidade)
+
+            inicio = time.perf_counter()
+            inserir_conteudo_word(args.modelo, conteudo, {}, {}, output_path, dpi=None)
+            duracao = time.perf_counter() - inicio
+            resultados.append((quantidade, duracao))
+
+    print()
+    print(f"{'images':>8} {'seconds':>10} {'ms/image':>10}")
+    for quantidade, duracao in resultados:
+        print(f"{quantidade:>8} {duracao:>10.2f} {duracao / quantidade * 1000:>10.2f}")
+
+    # Linear growth keeps the per-image cost flat between the extremes
+    menor, maior = resultados[0], resultados[-1]
+    fator = (maior[1] / maior[0]) / (menor[1] / menor[0])
+    print(f"\nPer-image cost ratio {maior[0]} vs {menor[0]} images: {fator:.2f}x (1.0 = perfectly linear)")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,267 @@
+"""
+Benchmark suite of the ZIP -> DOCX pipeline
+
+Builds reproducible synthetic ZIPs (fixed seed, folder trees of depth 1 to 3,
+mixed JPEG/PNG photos of several sizes) and runs every stage against each
+bundled model:
+
+  processar_zip            structure, thumbnails and duplicate detection
+  substituir_placeholders  template load and placeholder replacement
+  inserir_conteudo_word    full report assembly and save
+
+Every stage runs in a fresh subprocess, so its peak RSS is measured alone.
+Results (wall time, peak RSS, output size) are written as JSON with sorted
+keys, to be diffed between versions.
+
+Usage: python benchmarks/bench_pipeline.py [--casos 10:1,100:2,500:3]
+           [--modelos modelo_3575,...] [--workers 1] [--saida benchmarks/resultados/bench_pipeline.json]
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import re
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PASTA_MODELOS = os.path.join(RAIZ, 'models')
+MODELOS_PADRAO = ['modelo_3575', 'modelo_6122', 'modelo_0908', 'modelo_2056', 'modelo_2057']
+ESTAGIOS = ['processar_zip', 'substituir_placeholders', 'inserir_conteudo_word']
+SEMENTE = 20240601
+
+# (format, width, height, share of the images)
+PERFIS_IMAGEM = [
+    ('JPEG', 4000, 3000, 0.2),  # 12 MP phone photo
+    ('JPEG', 1600, 1200, 0.5),
+    ('JPEG', 640, 480, 0.2),
+    ('PNG', 1024, 768, 0.1),    # Screenshots and scanned sketches
+]
+PASTAS_RAIZ = ["- Área externa", "- Área interna", "- Segundo piso", "- Detalhes", "- Vista ampla"]
+
+def _pico_rss_kb():
+    """
+    Peak RSS of this process in KB
+    On Linux ru_maxrss keeps the high-water mark of the parent across fork and
+    exec, so VmHWM (reset by exec) is preferred when /proc is available
+    """
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for linha in f:
+                if linha.startswith('VmHWM:'):
+                    return int(linha.split()[1])
+    except OSError:
+        pass
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    maximo = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maximo // 1024 if sys.platform == 'darwin' else maximo
+
+def _pico_rss_mb():
+    """Peak RSS of this process, or of its largest finished pool worker, in MB"""
+    filhos = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    if sys.platform == 'darwin':
+        filhos //= 1024
+    return round(max(_pico_rss_kb(), filhos) / 1024, 1)
+
+def _pastas_folha(profundidade):
+    """Leaf folder paths of a tree with the given depth under the agency folder"""
+    folhas = [[nome] for nome in PASTAS_RAIZ]
+    for nivel in range(1, profundidade):
+        folhas = [caminho + [f"{'Sub' * nivel}pasta {n}"] for caminho in folhas for n in (1, 2)]
+    return ['AG 0000/' + '/'.join(caminho) for caminho in folhas]
+
+def gerar_zip(zip_path, quantidade, profundidade):
+    """Write quantidade distinct synthetic photos spread over the leaf folders"""
+    aleatorio = random.Random(SEMENTE + quantidade * 10 + profundidade)
+    from PIL import Image, ImageDraw, ImageFilter
+
+    # One textured base per profile; each image gets its own shapes on top
+    bases = {}
+    for formato, largura, altura, _ in PERFIS_IMAGEM:
+        ruido = Image.effect_noise((largura // 8, altura // 8), 64).convert('RGB')
+        bases[(formato, largura, altura)] = ruido.resize((largura, altura)).filter(ImageFilter.GaussianBlur(4))
+
+    folhas = _pastas_folha(profundidade)
+    pesos = [perfil[3] for perfil in PERFIS_IMAGEM]
+    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zip_ref:
+        for i in range(quantidade):
+            formato, largura, altura, _ = aleatorio.choices(PERFIS_IMAGEM, pesos)[0]
+            imagem = bases[(formato, largura, altura)].copy()
+            desenho = ImageDraw.Draw(imagem)
+            for _ in range(6):
+                x, y = aleatorio.randrange(largura), aleatorio.randrange(altura)
+                cor = tuple(aleatorio.randrange(256) for _ in range(3))
+                desenho.rectangle([x, y, x + largura // 4, y + altura // 4], fill=cor)
+
+            buffer = io.BytesIO()
+            if formato == 'JPEG':
+                imagem.save(buffer, 'JPEG', quality=90)
+            else:
+                imagem.save(buffer, 'PNG', compress_level=1)
+            extensao = 'jpg' if formato == 'JPEG' else 'png'
+            zip_ref.writestr(f"{folhas[i % len(folhas)]}/IMG_{i:05d}.{extensao}", buffer.getvalue())
+
+def _placeholders_do_modelo(modelo_path):
+    """Map every {{key}} found in the model to a form field of the same name"""
+    from docx import Document
+    from template_cache import paragrafos_com_placeholders
+    from docx.text.paragraph import Paragraph
+
+    chaves = set()
+    for _, p in paragrafos_com_placeholders(Document(modelo_path)):
+        chaves.update(re.findall(r'\{\{[^{}]+\}\}', Paragraph(p, None).text))
+    chaves.discard('{{start_here}}')
+    placeholders = {chave: chave.strip('{}') for chave in sorted(chaves)}
+    dados = {campo: f"Valor de {campo}" for campo in placeholders.values()}
+    return placeholders, dados
+
+def executar_estagio(estagio, caso):
+    """
+    Run one stage in this process and return its measurements
+    The 'importar' stage only loads the pipeline, as the RSS baseline
+    """
+    from word_utils import processar_zip, substituir_placeholders, inserir_conteudo_word
+    from template_cache import template_cache
+
+    resultado = {}
+    if estagio == 'processar_zip':
+        inicio = time.perf_counter()
+        conteudo = processar_zip(caso['zip_path'], {}, streaming=True,
+                                 pasta_miniaturas=caso['pasta_miniaturas'],
+                                 workers=caso['workers'], deduplicar=True)
+        resultado['segundos'] = time.perf_counter() - inicio
+        resultado['bytes_miniaturas'] = sum(
+            os.path.getsize(os.path.join(caso['pasta_miniaturas'], nome))
+            for nome in os.listdir(caso['pasta_miniaturas'])
+        )
+        with open(caso['conteudo_path'], 'w', encoding='utf-8') as f:
+            json.dump(conteudo, f)
+
+    elif estagio == 'substituir_placeholders':
+        placeholders, dados = _placeholders_do_modelo(caso['modelo_path'])
+        inicio = time.perf_counter()
+        doc, paragrafos, _ = template_cache.obter(caso['modelo_path'])
+        resultado['segundos_carregar_modelo'] = time.perf_counter() - inicio
+        inicio = time.perf_counter()
+        nao_encontrados = substituir_placeholders(doc, dados, placeholders, paragrafos)
+        resultado['segundos'] = time.perf_counter() - inicio
+        resultado['placeholders'] = len(placeholders) - len(nao_encontrados)
+
+    elif estagio == 'inserir_conteudo_word':
+        placeholders, dados = _placeholders_do_modelo(caso['modelo_path'])
+        with open(caso['conteudo_path'], 'r', encoding='utf-8') as f:
+            conteudo = json.load(f)
+        inicio = time.perf_counter()
+        resultado['imagens'] = inserir_conteudo_word(caso['modelo_path'], conteudo, placeholders, dados,
+                                                     caso['output_path'], workers=caso['workers'])
+        resultado['segundos'] = time.perf_counter() - inicio
+        resultado['bytes_saida'] = os.path.getsize(caso['output_path'])
+
+    resultado['pico_rss_mb'] = _pico_rss_mb()
+    return resultado
+
+def _em_subprocesso(estagio, caso):
+    """Run a stage in a fresh interpreter; its last stdout line is the JSON result"""
+    comando = [sys.executable, os.path.abspath(__file__), '--estagio', estagio, '--caso', json.dumps(caso)]
+    saida = subprocess.run(comando, capture_output=True, text=True, cwd=RAIZ)
+    if saida.returncode != 0:
+        raise RuntimeError(f"{estagio} failed:\n{saida.stderr}")
+    return json.loads(saida.stdout.strip().splitlines()[-1])
+
+def _rss_base():
+    """Peak RSS of a subprocess that only imports the pipeline, to subtract mentally"""
+    comando = [sys.executable, os.path.abspath(__file__), '--estagio', 'importar', '--caso', '{}']
+    saida = subprocess.run(comando, capture_output=True, text=True, cwd=RAIZ, check=True)
+    return json.loads(saida.stdout.strip().splitlines()[-1])['pico_rss_mb']
+
+def _versao():
+    """Commit being measured, when run inside the git checkout"""
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True,
+                              text=True, cwd=RAIZ, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def _arredondar(valor):
+    return round(valor, 4) if isinstance(valor, float) else valor
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--casos', default='10:1,100:2,500:3',
+                        help='Comma separated images:depth cases, e.g. 2000:3')
+    parser.add_argument('--modelos', default=','.join(MODELOS_PADRAO), help='Comma separated model names')
+    parser.add_argument('--workers', type=int, default=1, help='Image processes per stage')
+    parser.add_argument('--saida', default=os.path.join(RAIZ, 'benchmarks', 'resultados', 'bench_pipeline.json'),
+                        help='JSON result file (default: benchmarks/resultados/, ignored by git)')
+    parser.add_argument('--estagio', help=argparse.SUPPRESS)
+    parser.add_argument('--caso', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # Child mode: measure a single stage
+    if args.estagio:
+        resultado = executar_estagio(args.estagio, json.loads(args.caso))
+        print(json.dumps(resultado))
+        return
+
+    casos = [tuple(int(v) for v in caso.split(':')) for caso in args.casos.split(',')]
+    modelos = args.modelos.split(',')
+    resultados = []
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for quantidade, profundidade in casos:
+            zip_path = os.path.join(temp_dir, f'fotos_{quantidade}_{profundidade}.zip')
+            inicio = time.perf_counter()
+            gerar_zip(zip_path, quantidade, profundidade)
+            print(f"ZIP {quantidade} images, depth {profundidade}: "
+                  f"{os.path.getsize(zip_path) / 1024 / 1024:.1f} MB in {time.perf_counter() - inicio:.1f}s")
+
+            for modelo in modelos:
+                pasta_caso = os.path.join(temp_dir, f'{modelo}_{quantidade}_{profundidade}')
+                os.makedirs(pasta_caso)
+                caso = {
+                    'zip_path': zip_path,
+                    'modelo_path': os.path.join(PASTA_MODELOS, f'{modelo}.docx'),
+                    'pasta_miniaturas': os.path.join(pasta_caso, 'thumbs'),
+                    'conteudo_path': os.path.join(pasta_caso, 'conteudo.json'),
+                    'output_path': os.path.join(pasta_caso, 'relatorio.docx'),
+                    'workers': args.workers,
+                }
+                estagios = {}
+                for estagio in ESTAGIOS:
+                    medidas = _em_subprocesso(estagio, caso)
+                    estagios[estagio] = {chave: _arredondar(valor) for chave, valor in medidas.items()}
+                    print(f"  {modelo:<12} {estagio:<24} {medidas['segundos']:>8.2f}s "
+                          f"{medidas['pico_rss_mb']:>8.1f} MB")
+                resultados.append({
+                    'modelo': modelo,
+                    'imagens': quantidade,
+                    'profundidade': profundidade,
+                    'bytes_zip': os.path.getsize(zip_path),
+                    'estagios': estagios,
+                })
+                shutil.rmtree(pasta_caso, ignore_errors=True)
+
+    relatorio = {
+        'versao': _versao(),
+        'python': platform.python_version(),
+        'plataforma': platform.platform(),
+        'workers': args.workers,
+        'rss_base_mb': _rss_base(),
+        'casos': resultados,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.saida)), exist_ok=True)
+    with open(args.saida, 'w', encoding='utf-8') as f:
+        json.dump(relatorio, f, indent=2, sort_keys=True, ensure_ascii=False)
+    print(f"\nResults written to {args.saida}")
+
+if __name__ == '__main__':
+    main()
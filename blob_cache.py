@@ -0,0 +1,140 @@
+import hashlib
+import os
+import threading
+import time
+import uuid
+from datetime import timedelta
+
+# Limite padrão do cache em disco
+TAMANHO_MAXIMO_PADRAO = 2 * 1024 * 1024 * 1024
+
+# Intervalo máximo sem varrer o cache, para contar o que outros processos gravaram
+INTERVALO_REDUCAO = timedelta(minutes=10)
+
+
+class BlobCache:
+    """
+    Cache em disco de blobs endereçados pelo conteúdo de origem
+    A chave combina o SHA-256 do arquivo original com os parâmetros do
+    processamento; o limite de tamanho descarta primeiro os menos usados (LRU)
+    Pode ser usado por vários processos: cada entrada é gravada de forma atômica
+    Cada processo soma o que grava ao total da última varredura, então
+    reduzir() só percorre o diretório quando esse total passa do limite ou
+    a cada INTERVALO_REDUCAO
+    """
+
+    def __init__(self, base_dir='cache', tamanho_maximo=TAMANHO_MAXIMO_PADRAO):
+        self.base_dir = base_dir
+        self.tamanho_maximo = tamanho_maximo
+        self._total = None  # Bytes estimados; None até a primeira varredura
+        self._ultima_reducao = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.base_dir, exist_ok=True)
+
+    @staticmethod
+    def chave(sha256, *parametros):
+        """Chave da entrada para o conteúdo sha256 processado com os parâmetros dados"""
+        return hashlib.sha256(f"{sha256}|{parametros!r}".encode('utf-8')).hexdigest()
+
+    def _caminho(self, chave):
+        # Subdiretórios pelos dois primeiros caracteres evitam diretórios enormes
+        return os.path.join(self.base_dir, chave[:2], chave)
+
+    def obter(self, chave):
+        """Retorna os bytes da entrada ou None; um acerto a marca como usada agora"""
+        caminho = self._caminho(chave)
+        try:
+            with open(caminho, 'rb') as f:
+                dados = f.read()
+            os.utime(caminho)
+            return dados
+        except OSError:
+            return None
+
+    def contem(self, chave):
+        """Verifica se a entrada existe, sem lê-la"""
+        return os.path.exists(self._caminho(chave))
+
+    def guardar(self, chave, dados):
+        """Grava a entrada de forma atômica (arquivo temporário + rename)"""
+        caminho = self._caminho(chave)
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        temporario = f"{caminho}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(temporario, 'wb') as f:
+                f.write(dados)
+            os.replace(temporario, caminho)
+            with self._lock:
+                if self._total is not None:
+                    self._total += len(dados)  # Substituir uma entrada superestima até a próxima varredura
+        except OSError as e:
+            print(f"Erro ao gravar no cache: {e}")
+            try:
+                os.remove(temporario)
+            except OSError:
+                pass
+
+    def _entradas(self):
+        """Lista (mtime, tamanho, caminho) de todas as entradas"""
+        entradas = []
+        for raiz, _, arquivos in os.walk(self.base_dir):
+            for nome in arquivos:
+                if nome.endswith('.tmp'):
+                    continue
+                caminho = os.path.join(raiz, nome)
+                try:
+                    info = os.stat(caminho)
+                except OSError:
+                    continue  # Removida por outro processo
+                entradas.append((info.st_mtime, info.st_size, caminho))
+        return entradas
+
+    def tamanho_total(self):
+        """Bytes ocupados por todas as entradas"""
+        return sum(tamanho for _, tamanho, _ in self._entradas())
+
+    def reduzir(self):
+        """
+        Remove as entradas usadas há mais tempo até o cache caber no limite
+        Sem varrer o diretório enquanto o total estimado couber no limite e a
+        última varredura tiver menos de INTERVALO_REDUCAO
+        Retorna quantas entradas foram removidas
+        """
+        with self._lock:
+            if (self._total is not None and self._total <= self.tamanho_maximo
+                    and time.monotonic() - self._ultima_reducao < INTERVALO_REDUCAO.total_seconds()):
+                return 0
+            self._ultima_reducao = time.monotonic()
+
+        entradas = sorted(self._entradas())
+        total = sum(tamanho for _, tamanho, _ in entradas)
+        removidas = 0
+        for _, tamanho, caminho in entradas:
+            if total <= self.tamanho_maximo:
+                break
+            try:
+                os.remove(caminho)
+                removidas += 1
+            except OSError:
+                pass
+            total -= tamanho
+        with self._lock:
+            self._total = total
+        return removidas
+
+    def limpar(self):
+        """Remove todas as entradas"""
+        for _, _, caminho in self._entradas():
+            try:
+                os.remove(caminho)
+            except OSError:
+                pass
+        with self._lock:
+            self._total = 0
+
+
+# Instância global do cache de imagens preparadas e miniaturas
+blob_cache = BlobCache(
+    base_dir=os.environ.get('BLOB_CACHE_DIR', 'cache'),
+    tamanho_maximo=int(os.environ.get('BLOB_CACHE_MB', TAMANHO_MAXIMO_PADRAO // (1024 * 1024))) * 1024 * 1024
+)
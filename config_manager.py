@@ -1,13 +1,32 @@
+import copy
 import json
 import os
+import threading
 from datetime import datetime
+from database import database as database_padrao
+
+# Linha da tabela configuracao com a configuração dos placeholders
+CHAVE_CONFIG = 'placeholders'
 
 class ConfigManager:
-    """Gerenciador de configurações para placeholders do sistema"""
+    """
+    Gerenciador de configurações para placeholders do sistema
+    
+    A configuração fica no banco compartilhado pelos workers: cada leitura
+    confere o número de versão e recarrega só quando outro processo gravou;
+    alterações são feitas em uma transação. config_file, o JSON usado antes
+    do banco, só é lido para importar a configuração na primeira execução.
+    As visões por tipo e por seção são calculadas uma vez por versão da
+    configuração e não devem ser alteradas.
+    """
     
-    def __init__(self, config_file='config/placeholders_config.json'):
+    def __init__(self, config_file='config/placeholders_config.json', database=None):
         self.config_file = config_file
-        self.ensure_config_dir()
+        self.database = database or database_padrao
+        self._config = None
+        self._versao = None
+        self._visoes = {}
+        self._lock = threading.RLock()
         self.default_config = {
             # Configuração padrão dos placeholders
             'placeholders': {
@@ -109,89 +128,168 @@ class ConfigManager:
                 'responsaveis': 'Responsáveis',
                 'empresa': 'Informações da Empresa'
             },
+            # Ordenação das fotos em cada pasta: política padrão e exceções por nome da pasta
+            'ordenacao': {
+                'padrao': 'captura',
+                'pastas': {}
+            },
             'updated_at': datetime.now().isoformat()
         }
         self.load_config()
     
-    def ensure_config_dir(self):
-        """Garante que o diretório de configuração existe"""
-        config_dir = os.path.dirname(self.config_file)
-        if config_dir:
-            os.makedirs(config_dir, exist_ok=True)
+    @property
+    def config(self):
+        """Configuração atual, recarregada se outro processo a alterou"""
+        self._recarregar_se_mudou()
+        return self._config
+    
+    @config.setter
+    def config(self, config):
+        with self._lock:
+            self._config = config
+            self._visoes = {}
+    
+    def _versao_gravada(self):
+        """Número da versão gravada no banco (None se ainda não existir)"""
+        linha = self.database.conexao().execute(
+            'SELECT versao FROM configuracao WHERE chave = ?', (CHAVE_CONFIG,)).fetchone()
+        return linha['versao'] if linha else None
+    
+    def _recarregar_se_mudou(self):
+        """Relê a configuração quando outro processo a gravou; custa uma consulta pela chave"""
+        with self._lock:
+            if self._config is None or self._versao_gravada() != self._versao:
+                self.load_config()
     
     def load_config(self):
-        """Carrega configuração do arquivo ou cria padrão"""
-        try:
-            if os.path.exists(self.config_file):
-                with open(self.config_file, 'r', encoding='utf-8') as f:
-                    self.config = json.load(f)
+        """Carrega configuração do banco, importando o arquivo JSON ou criando a padrão"""
+        with self._lock:
+            try:
+                linha = self.database.conexao().execute(
+                    'SELECT valor, versao FROM configuracao WHERE chave = ?', (CHAVE_CONFIG,)).fetchone()
+                if linha:
+                    self.config = json.loads(linha['valor'])
+                    self._versao = linha['versao']
+                elif os.path.exists(self.config_file):
+                    with open(self.config_file, 'r', encoding='utf-8') as f:
+                        self.config = json.load(f)
+                    self.save_config()
+                else:
+                    self.config = copy.deepcopy(self.default_config)
+                    self.save_config()
                 # Merge com configuração padrão para novos campos
                 self._merge_with_default()
-            else:
-                self.config = self.default_config.copy()
-                self.save_config()
-        except Exception as e:
-            print(f"Erro ao carregar configuração: {e}")
-            self.config = self.default_config.copy()
+            except Exception as e:
+                print(f"Erro ao carregar configuração: {e}")
+                self.config = copy.deepcopy(self.default_config)
     
     def _merge_with_default(self):
         """Mescla configuração existente com novos campos padrão"""
         for key, value in self.default_config['placeholders'].items():
-            if key not in self.config['placeholders']:
-                self.config['placeholders'][key] = value
+            if key not in self._config['placeholders']:
+                self._config['placeholders'][key] = copy.deepcopy(value)
         
         # Atualiza seções se necessário
-        self.config['sections'] = self.default_config['sections']
+        self._config['sections'] = copy.deepcopy(self.default_config['sections'])
+        
+        # Configurações anteriores à ordenação das fotos
+        self._config.setdefault('ordenacao', copy.deepcopy(self.default_config['ordenacao']))
     
     def save_config(self):
-        """Salva configuração no arquivo"""
+        """Salva configuração no banco, incrementando sua versão"""
         try:
-            self.config['updated_at'] = datetime.now().isoformat()
-            with open(self.config_file, 'w', encoding='utf-8') as f:
-                json.dump(self.config, f, indent=2, ensure_ascii=False)
+            with self._lock, self.database.transacao() as conexao:
+                self._config['updated_at'] = datetime.now().isoformat()
+                conexao.execute(
+                    'INSERT INTO configuracao (chave, valor, versao, atualizado_em) VALUES (?, ?, 1, ?) '
+                    'ON CONFLICT (chave) DO UPDATE SET valor = excluded.valor, '
+                    'versao = configuracao.versao + 1, atualizado_em = excluded.atualizado_em',
+                    (CHAVE_CONFIG, json.dumps(self._config, ensure_ascii=False), self._config['updated_at']))
+                self._versao = self._versao_gravada()
+                self._visoes = {}
             return True
         except Exception as e:
             print(f"Erro ao salvar configuração: {e}")
+            self._versao = None  # Descarta a cópia em memória na próxima leitura
             return False
     
+    def reset(self):
+        """Restaura a configuração padrão"""
+        with self._lock:
+            self.config = copy.deepcopy(self.default_config)
+            return self.save_config()
+    
     def get_placeholder_config(self, placeholder_key):
         """Retorna configuração de um placeholder específico"""
         return self.config['placeholders'].get(placeholder_key, {})
     
+    def update_placeholders(self, alteracoes, ordenacao=None):
+        """
+        Atualiza vários placeholders e grava a configuração uma única vez
+        alteracoes mapeia a chave do placeholder para (tipo, valor, label);
+        label None mantém o atual. As alterações são aplicadas sobre a versão
+        mais recente no banco, sem desfazer edições de outros workers
+        ordenacao, quando informada, substitui a ordenação das fotos na mesma gravação
+        Retorna False se alguma chave não existir (nada é gravado)
+        """
+        with self._lock, self.database.transacao():
+            self._recarregar_se_mudou()
+            placeholders = self._config['placeholders']
+            if any(key not in placeholders for key in alteracoes):
+                return False
+            for key, (field_type, value, label) in alteracoes.items():
+                placeholders[key]['type'] = field_type
+                placeholders[key]['value'] = value
+                if label:
+                    placeholders[key]['label'] = label
+            if ordenacao is not None:
+                self._config['ordenacao'] = copy.deepcopy(ordenacao)
+            return self.save_config()
+    
     def update_placeholder(self, placeholder_key, field_type, value, label=None):
         """Atualiza configuração de um placeholder"""
-        if placeholder_key in self.config['placeholders']:
-            self.config['placeholders'][placeholder_key]['type'] = field_type
-            self.config['placeholders'][placeholder_key]['value'] = value
-            if label:
-                self.config['placeholders'][placeholder_key]['label'] = label
-            return self.save_config()
-        return False
+        return self.update_placeholders({placeholder_key: (field_type, value, label)})
+    
+    def _visao(self, nome, calcular):
+        """Resultado de calcular(config), guardado até a configuração mudar"""
+        with self._lock:
+            self._recarregar_se_mudou()
+            if nome not in self._visoes:
+                self._visoes[nome] = calcular(self._config)
+            return self._visoes[nome]
     
     def get_variable_fields(self):
         """Retorna apenas campos configurados como variáveis"""
-        return {
-            key: config for key, config in self.config['placeholders'].items()
+        return self._visao('variable', lambda c: {
+            key: config for key, config in c['placeholders'].items()
             if config.get('type') == 'variable'
-        }
+        })
     
     def get_fixed_fields(self):
         """Retorna apenas campos configurados como fixos"""
-        return {
-            key: config for key, config in self.config['placeholders'].items()
+        return self._visao('fixed', lambda c: {
+            key: config for key, config in c['placeholders'].items()
             if config.get('type') == 'fixed'
-        }
+        })
+    
+    def get_ordenacao(self):
+        """Ordenação das fotos: {'padrao': política, 'pastas': {nome da pasta: política}}"""
+        return self._visao('ordenacao', lambda c: c['ordenacao'])
     
     def get_all_placeholders(self):
         """Retorna todos os placeholders organizados por seção"""
+        return self._visao('all', self._organizar_por_secao)
+    
+    @staticmethod
+    def _organizar_por_secao(config_atual):
         organized = {}
-        for section_key, section_name in self.config['sections'].items():
+        for section_key, section_name in config_atual['sections'].items():
             organized[section_key] = {
                 'name': section_name,
                 'placeholders': {}
             }
         
-        for key, config in self.config['placeholders'].items():
+        for key, config in config_atual['placeholders'].items():
             section = config.get('section', 'outros')
             if section not in organized:
                 organized[section] = {
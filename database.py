@@ -0,0 +1,97 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# Tabelas do estado compartilhado entre os workers
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS configuracao (
+    chave TEXT PRIMARY KEY,
+    valor TEXT NOT NULL,
+    versao INTEGER NOT NULL,
+    atualizado_em TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS manifestos (
+    upload_id TEXT PRIMARY KEY,
+    dados TEXT NOT NULL,
+    atualizado_em REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS relatorios (
+    arquivo TEXT PRIMARY KEY,
+    projeto TEXT,
+    modelo TEXT,
+    imagens INTEGER,
+    tamanho INTEGER NOT NULL,
+    criado_em TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS relatorios_criado_em ON relatorios (criado_em);
+CREATE INDEX IF NOT EXISTS relatorios_projeto ON relatorios (projeto, criado_em);
+
+CREATE TABLE IF NOT EXISTS tarefas (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    total INTEGER NOT NULL,
+    done INTEGER NOT NULL,
+    resultado TEXT,
+    erro TEXT,
+    saida TEXT,
+    criado_em TEXT NOT NULL,
+    finalizado_em TEXT
+);
+CREATE INDEX IF NOT EXISTS tarefas_finalizado_em ON tarefas (finalizado_em);
+"""
+
+
+class Database:
+    """
+    Banco SQLite em modo WAL com o estado compartilhado pelos workers
+    Leitores não bloqueiam nem são bloqueados pelo escritor; escritas passam
+    por transacao(), que serializa os escritores de todos os processos
+    Cada thread (e cada processo, após um fork) usa sua própria conexão
+    """
+
+    def __init__(self, caminho='data/relatorios.db', timeout=30):
+        self.caminho = caminho
+        self.timeout = timeout
+        self._local = threading.local()
+        diretorio = os.path.dirname(caminho)
+        if diretorio:
+            os.makedirs(diretorio, exist_ok=True)
+        self.conexao().executescript(ESQUEMA)
+
+    def conexao(self):
+        """Conexão da thread atual, em modo autocommit"""
+        conexao = getattr(self._local, 'conexao', None)
+        if conexao is None or self._local.pid != os.getpid():
+            conexao = sqlite3.connect(self.caminho, timeout=self.timeout, isolation_level=None)
+            conexao.row_factory = sqlite3.Row
+            conexao.execute('PRAGMA journal_mode=WAL')
+            conexao.execute('PRAGMA synchronous=NORMAL')
+            self._local.conexao = conexao
+            self._local.pid = os.getpid()
+        return conexao
+
+    @contextmanager
+    def transacao(self):
+        """
+        Transação de escrita (BEGIN IMMEDIATE): a trava de escrita é obtida no
+        início, então ler-alterar-gravar dentro dela não perde edições de outro
+        processo. Reentrante: dentro de outra transação, apenas participa dela
+        """
+        conexao = self.conexao()
+        if conexao.in_transaction:
+            yield conexao
+            return
+        conexao.execute('BEGIN IMMEDIATE')
+        try:
+            yield conexao
+        except BaseException:
+            conexao.rollback()
+            raise
+        conexao.commit()
+
+
+# Instância global do banco
+database = Database(os.environ.get('DATABASE_PATH', 'data/relatorios.db'))
@@ -0,0 +1,114 @@
+import os
+import shutil
+import time
+import zipfile
+from docx.opc.packuri import CONTENT_TYPES_URI, PACKAGE_URI
+from docx.opc.pkgwriter import _ContentTypesItem
+from docx.parts.image import ImagePart
+
+# Bloco usado ao copiar uma imagem do disco para o pacote
+TAMANHO_BLOCO = 1024 * 1024
+
+# Sufixo do arquivo enquanto ele ainda está sendo gravado
+SUFIXO_PARCIAL = '.parcial'
+
+
+def caminho_parcial(output_path):
+    """Caminho onde output_path é gravado antes de ficar completo"""
+    return output_path + SUFIXO_PARCIAL
+
+
+class _EscritaSequencial:
+    """
+    Arquivo só de escrita e sem seek: assim o zipfile grava cada membro com
+    data descriptor, sem voltar para corrigir cabeçalhos já escritos, e os
+    bytes gravados podem ser lidos (e enviados) enquanto o arquivo cresce
+    """
+
+    def __init__(self, arquivo):
+        self._arquivo = arquivo
+        self._posicao = 0
+
+    def write(self, dados):
+        self._arquivo.write(dados)
+        self._posicao += len(dados)
+        return len(dados)
+
+    def tell(self):
+        return self._posicao
+
+    def flush(self):
+        self._arquivo.flush()
+
+
+class ParteImagemEmDisco(ImagePart):
+    """
+    Parte de imagem cujo conteúdo fica em um arquivo, não na memória
+    O SHA1 é guardado na criação; os bytes só são lidos se alguém pedir o blob
+    """
+
+    def __init__(self, partname, content_type, caminho, sha1):
+        super().__init__(partname, content_type, None)
+        self.caminho = caminho
+        self._sha1 = sha1
+
+    @classmethod
+    def gravar(cls, partname, imagem, pasta):
+        """Grava os bytes de imagem (docx.image.Image) em pasta e cria a parte"""
+        caminho = os.path.join(pasta, os.path.basename(partname))
+        with open(caminho, 'wb') as f:
+            f.write(imagem.blob)
+        return cls(partname, imagem.content_type, caminho, imagem.sha1)
+
+    @property
+    def blob(self):
+        with open(self.caminho, 'rb') as f:
+            return f.read()
+
+    @property
+    def sha1(self):
+        return self._sha1
+
+
+def salvar_documento(doc, output_path):
+    """
+    Grava o documento como doc.save, mas copia as partes em disco para o ZIP
+    em blocos, uma por vez, sem montar o pacote inteiro na memória
+    As imagens (JPEG/PNG, já comprimidas) são armazenadas sem recompressão
+    O arquivo é gravado só com acréscimos em caminho_parcial(output_path) e
+    renomeado ao final, então output_path nunca aparece incompleto
+    """
+    pacote = doc.part.package
+    partes = list(pacote.iter_parts())
+    for parte in partes:
+        parte.before_marshal()
+
+    parcial = caminho_parcial(output_path)
+    try:
+        with open(parcial, 'wb') as arquivo:
+            with zipfile.ZipFile(_EscritaSequencial(arquivo), 'w', compression=zipfile.ZIP_DEFLATED) as zip_ref:
+                zip_ref.writestr(CONTENT_TYPES_URI.membername, _ContentTypesItem.from_parts(partes).blob)
+                zip_ref.writestr(PACKAGE_URI.rels_uri.membername, pacote.rels.xml)
+                for parte in partes:
+                    if isinstance(parte, ParteImagemEmDisco):
+                        _copiar_para_zip(zip_ref, parte)
+                    else:
+                        zip_ref.writestr(parte.partname.membername, parte.blob)
+                    if len(parte.rels):
+                        zip_ref.writestr(parte.partname.rels_uri.membername, parte.rels.xml)
+        os.replace(parcial, output_path)
+    except BaseException:
+        try:
+            os.remove(parcial)
+        except OSError:
+            pass
+        raise
+
+
+def _copiar_para_zip(zip_ref, parte):
+    """Copia o arquivo da parte para o ZIP em blocos de TAMANHO_BLOCO"""
+    info = zipfile.ZipInfo(parte.partname.membername, date_time=time.localtime()[:6])
+    info.compress_type = zipfile.ZIP_STORED
+    info.file_size = os.path.getsize(parte.caminho)
+    with open(parte.caminho, 'rb') as origem, zip_ref.open(info, 'w') as destino:
+        shutil.copyfileobj(origem, destino, TAMANHO_BLOCO)
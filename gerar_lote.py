@@ -0,0 +1,155 @@
+"""
+Batch report generation from a manifest of agencies
+
+The manifest is a CSV (one row per report, header with the form field names)
+or a JSON list of objects with the same keys. Besides the fields of the web
+form, each entry names its ZIP in arquivo_zip, relative to the manifest.
+Reports are generated across a process pool and a throughput summary is
+printed at the end.
+
+Usage: python gerar_lote.py manifesto.csv [--saida output] [--workers 4]
+"""
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from app import app, PLACEHOLDERS, validate_form_data, nome_relatorio
+from blob_cache import blob_cache
+from config_manager import config_manager
+from output_store import output_store
+from word_utils import processar_zip, inserir_conteudo_word
+
+def carregar_manifesto(manifesto_path):
+    """Read the manifest entries, resolving ZIP paths relative to the manifest"""
+    with open(manifesto_path, 'r', encoding='utf-8-sig', newline='') as f:
+        if manifesto_path.lower().endswith('.json'):
+            entradas = json.load(f)
+        else:
+            entradas = list(csv.DictReader(f))
+
+    base = os.path.dirname(os.path.abspath(manifesto_path))
+    for entrada in entradas:
+        if entrada.get('arquivo_zip'):
+            entrada['arquivo_zip'] = os.path.join(base, entrada['arquivo_zip'])
+    return entradas
+
+def validar_entrada(entrada):
+    """Return the list of problems that prevent generating the entry"""
+    form_data = {k: v for k, v in entrada.items() if k != 'arquivo_zip'}
+    erros = validate_form_data(form_data)
+    zip_path = entrada.get('arquivo_zip')
+    if not zip_path or not os.path.isfile(zip_path):
+        erros.append(f'Arquivo ZIP não encontrado: {zip_path}')
+    modelo_path = os.path.join(app.config['MODELS_FOLDER'], f"{entrada.get('modelo_selecionado')}.docx")
+    if entrada.get('modelo_selecionado') and not os.path.isfile(modelo_path):
+        erros.append(f"Modelo não encontrado: {entrada['modelo_selecionado']}")
+    return erros
+
+def na_pasta_do_app(pasta_saida):
+    """True when reports go to the app's output folder, where they are indexed"""
+    return os.path.abspath(pasta_saida) == os.path.abspath(output_store.base_dir)
+
+def nomes_saida(entradas, pasta_saida):
+    """
+    Output path of each entry; repeated project names get a numbered suffix
+    In the app's output folder every report gets a unique name, as in the web flow
+    """
+    if na_pasta_do_app(pasta_saida):
+        return [output_store.unique_path(nome_relatorio(entrada.get('nome_projeto', ''))) for entrada in entradas]
+    usados = set()
+    caminhos = []
+    for entrada in entradas:
+        base, extensao = os.path.splitext(nome_relatorio(entrada.get('nome_projeto', '')))
+        nome, n = base + extensao, 1
+        while nome in usados:
+            n += 1
+            nome = f"{base} ({n}){extensao}"
+        usados.add(nome)
+        caminhos.append(os.path.join(pasta_saida, nome))
+    return caminhos
+
+def gerar_relatorio(entrada, output_path):
+    """
+    Generate one report the way the web flow does, reading images from the ZIP
+    Runs inside a pool process; returns (images inserted, seconds)
+    """
+    inicio = time.perf_counter()
+    form_data = {k: v for k, v in entrada.items() if k != 'arquivo_zip'}
+    modelo_path = os.path.join(app.config['MODELS_FOLDER'], f"{form_data['modelo_selecionado']}.docx")
+
+    # Parallelism comes from the report pool, so each report uses one process
+    conteudo = processar_zip(entrada['arquivo_zip'], form_data, streaming=True,
+                             deduplicar=app.config['DEDUP_IMAGES'], cache=blob_cache,
+                             ordenacao=config_manager.get_ordenacao())
+    num_imagens = inserir_conteudo_word(modelo_path, conteudo, PLACEHOLDERS,
+                                        config_manager.get_form_data_with_defaults(form_data),
+                                        output_path,
+                                        dpi=app.config['IMAGE_DPI'],
+                                        qualidade_jpeg=app.config['IMAGE_JPEG_QUALITY'],
+                                        cache=blob_cache)
+    return num_imagens, time.perf_counter() - inicio
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('manifesto', help='CSV or JSON manifest')
+    parser.add_argument('--saida', default=app.config['OUTPUT_FOLDER'], help='Output folder')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Reports generated in parallel')
+    args = parser.parse_args()
+
+    entradas = carregar_manifesto(args.manifesto)
+    os.makedirs(args.saida, exist_ok=True)
+
+    # Reject invalid entries up front instead of failing halfway through the batch
+    invalidas = 0
+    for numero, entrada in enumerate(entradas, 1):
+        for erro in validar_entrada(entrada):
+            print(f"Entry {numero}: {erro}")
+            invalidas += 1
+    if invalidas:
+        print("Manifest has errors, nothing was generated")
+        return 1
+
+    caminhos = nomes_saida(entradas, args.saida)
+    indexar = na_pasta_do_app(args.saida)
+    falhas = 0
+    total_imagens = 0
+    inicio = time.perf_counter()
+
+    # spawn keeps pool processes independent from the parent, as in image_utils
+    contexto = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=max(1, args.workers), mp_context=contexto) as executor:
+        futuros = {
+            executor.submit(gerar_relatorio, entrada, caminho): (entrada, caminho)
+            for entrada, caminho in zip(entradas, caminhos)
+        }
+        for concluidos, futuro in enumerate(as_completed(futuros), 1):
+            entrada, caminho = futuros[futuro]
+            try:
+                num_imagens, segundos = futuro.result()
+                total_imagens += num_imagens
+                if indexar:
+                    output_store.register(caminho, projeto=entrada['nome_projeto'],
+                                           modelo=entrada['modelo_selecionado'], imagens=num_imagens)
+                print(f"[{concluidos}/{len(futuros)}] {os.path.basename(caminho)}: "
+                      f"{num_imagens} images in {segundos:.1f}s")
+            except Exception as e:
+                falhas += 1
+                print(f"[{concluidos}/{len(futuros)}] {os.path.basename(caminho)}: FAILED: {e}")
+
+    duracao = time.perf_counter() - inicio
+    gerados = len(entradas) - falhas
+    print()
+    print(f"Reports generated: {gerados} of {len(entradas)} ({falhas} failed)")
+    print(f"Images embedded:   {total_imagens}")
+    print(f"Elapsed:           {duracao:.1f}s")
+    if duracao > 0:
+        print(f"Throughput:        {gerados / duracao * 60:.1f} reports/min, {total_imagens / duracao:.1f} images/s")
+    return 1 if falhas else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
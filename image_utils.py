@@ -0,0 +1,362 @@
+import hashlib
+import io
+import os
+import zipfile
+import zlib
+import multiprocessing
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, ImageOps, UnidentifiedImageError, features
+from metadados_imagem import ler_metadados, ORIENTACOES_ROTACIONADAS
+
+# Default preparation settings for images embedded in the report
+DPI_PADRAO = 220  # Same resolution Word uses when compressing pictures for print
+QUALIDADE_JPEG_PADRAO = 85
+
+# Preview thumbnails: longest side in pixels, WebP when this Pillow build supports it
+TAMANHO_MINIATURA = 256
+FORMATO_MINIATURA = 'WEBP' if features.check('webp') else 'JPEG'
+EXTENSAO_MINIATURA = '.webp' if FORMATO_MINIATURA == 'WEBP' else '.jpg'
+
+# Side of the grid behind the difference hash (dHash) used to spot near-duplicates
+TAMANHO_DHASH = 8
+
+def _ler_bytes(origem):
+    """Read the full content of a path or binary stream"""
+    if isinstance(origem, (bytes, bytearray)):
+        return bytes(origem)
+    if isinstance(origem, str):
+        with open(origem, 'rb') as f:
+            return f.read()
+    origem.seek(0)
+    return origem.read()
+
+def _tem_transparencia(img):
+    """Check whether the image carries an alpha channel or transparent color"""
+    return img.mode in ('RGBA', 'LA', 'PA') or 'transparency' in img.info
+
+def preparar_imagem(origem, altura_cm, dpi=DPI_PADRAO, qualidade_jpeg=QUALIDADE_JPEG_PADRAO):
+    """
+    Prepare an image for embedding at altura_cm display height
+    Applies EXIF orientation, downscales to the target DPI and re-encodes
+    Returns (stream, width_px, height_px); dpi=None keeps the original resolution
+    Upright JPEG/PNG that need no downscaling are recognized from their header
+    alone and returned untouched, without Pillow
+    """
+    dados = _ler_bytes(origem)
+
+    metadados = ler_metadados(dados)
+    if metadados and metadados.orientacao == 1:
+        if not dpi or metadados.altura <= max(1, round(altura_cm / 2.54 * dpi)):
+            return io.BytesIO(dados), metadados.largura, metadados.altura
+
+    with Image.open(io.BytesIO(dados)) as img:
+        formato = img.format
+        orientacao = img.getexif().get(0x0112, 1)
+        largura, altura = img.size
+        if orientacao in ORIENTACOES_ROTACIONADAS:
+            largura, altura = altura, largura
+
+        altura_alvo = altura
+        if dpi:
+            altura_alvo = min(altura, max(1, round(altura_cm / 2.54 * dpi)))
+        largura_alvo = max(1, round(largura * altura_alvo / altura))
+
+        # Already small enough and upright: embed the original bytes untouched
+        if altura_alvo == altura and orientacao == 1 and formato in ('JPEG', 'PNG'):
+            return io.BytesIO(dados), largura, altura
+
+        # Let the JPEG decoder scale down while decoding (DCT scaling)
+        if formato == 'JPEG':
+            if orientacao in ORIENTACOES_ROTACIONADAS:
+                img.draft('RGB', (altura_alvo, largura_alvo))
+            else:
+                img.draft('RGB', (largura_alvo, altura_alvo))
+
+        imagem = ImageOps.exif_transpose(img)
+        if imagem.size != (largura_alvo, altura_alvo):
+            imagem = imagem.resize((largura_alvo, altura_alvo), Image.LANCZOS)
+
+        saida = io.BytesIO()
+        if _tem_transparencia(imagem):
+            imagem.save(saida, 'PNG')
+        else:
+            if imagem.mode not in ('RGB', 'L'):
+                imagem = imagem.convert('RGB')
+            opcoes = {'dpi': (dpi, dpi)} if dpi else {}
+            imagem.save(saida, 'JPEG', quality=qualidade_jpeg, **opcoes)
+        saida.seek(0)
+        return saida, largura_alvo, altura_alvo
+
+# Errors raised while decompressing a damaged ZIP member (bad CRC, broken stream)
+ERROS_MEMBRO_ZIP = (zipfile.BadZipFile, zlib.error, EOFError)
+
+def _ler_dados_imagem(imagem_path, zip_path, arquivos_zip):
+    """
+    Read the bytes of an extracted image or of a ZIP member
+    Returns None when the image is missing or empty
+    Raises one of ERROS_MEMBRO_ZIP when the member fails its CRC check
+    """
+    if not zip_path:
+        if os.path.exists(imagem_path) and os.path.getsize(imagem_path) > 0:
+            with open(imagem_path, 'rb') as f:
+                return f.read()
+        return None
+
+    try:
+        zip_ref = arquivos_zip.get(zip_path)
+        if zip_ref is None:
+            zip_ref = arquivos_zip[zip_path] = zipfile.ZipFile(zip_path, 'r')
+        if zip_ref.getinfo(imagem_path).file_size == 0:
+            return None
+    except (OSError, KeyError, zipfile.BadZipFile):
+        return None
+    return zip_ref.read(imagem_path)
+
+def _preparar_item(tarefa, arquivos_zip):
+    """
+    Read and prepare one image, going through the blob cache when one is given
+    Returns (bytes, width_px, height_px, error message or None)
+    """
+    imagem_path, zip_path, altura_cm, dpi, qualidade_jpeg, sha256, cache = tarefa
+    parametros = ('preparada', altura_cm, dpi, qualidade_jpeg)
+
+    # Known content hash: a cache hit skips even reading the source
+    if cache and sha256:
+        resultado = _preparada_em_cache(cache, cache.chave(sha256, *parametros))
+        if resultado:
+            return resultado
+
+    try:
+        dados = _ler_dados_imagem(imagem_path, zip_path, arquivos_zip)
+    except ERROS_MEMBRO_ZIP as e:
+        return None, 0, 0, f"Error: Corrupted file in ZIP: {imagem_path} ({e})"
+    if dados is None:
+        return None, 0, 0, f"Error: Invalid image file: {imagem_path}"
+
+    chave = None
+    if cache:
+        chave = cache.chave(sha256 or hashlib.sha256(dados).hexdigest(), *parametros)
+        resultado = None if sha256 else _preparada_em_cache(cache, chave)
+        if resultado:
+            return resultado
+
+    try:
+        imagem, largura, altura = preparar_imagem(dados, altura_cm, dpi, qualidade_jpeg)
+        if chave:
+            cache.guardar(chave, imagem.getvalue())
+        return imagem.getvalue(), largura, altura, None
+    except UnidentifiedImageError:
+        return None, 0, 0, f"Error: Unrecognized image format: {imagem_path}"
+    except Exception as e:
+        return None, 0, 0, f"Error preparing image '{imagem_path}': {e}"
+
+def _preparada_em_cache(cache, chave):
+    """Prepared image from the cache as (bytes, width_px, height_px, None), or None"""
+    dados = cache.obter(chave)
+    if dados is None:
+        return None
+    # Prepared images are upright, so the header size is the display size
+    metadados = ler_metadados(dados)
+    if metadados is None:
+        return None
+    return dados, metadados.largura, metadados.altura, None
+
+def _calcular_dhash(img):
+    """64-bit difference hash: sign of the horizontal gradient on a 9x8 grayscale grid"""
+    cinza = img.convert('L').resize((TAMANHO_DHASH + 1, TAMANHO_DHASH), Image.BILINEAR)
+    pixels = list(cinza.getdata())
+    valor = 0
+    for linha in range(TAMANHO_DHASH):
+        inicio = linha * (TAMANHO_DHASH + 1)
+        for coluna in range(TAMANHO_DHASH):
+            valor = (valor << 1) | (pixels[inicio + coluna] > pixels[inicio + coluna + 1])
+    return f"{valor:016x}"
+
+def _analisar_imagem(tarefa, arquivos_zip):
+    """
+    Read one image once to hash it and, when destino is set, write its thumbnail
+    Returns a dict with sha256 and dhash, miniatura=True when the thumbnail was
+    written, or erro when the ZIP member is damaged; reading checks its CRC
+    With a blob cache, thumbnail and dHash of known content are not recomputed
+    """
+    imagem_path, zip_path, destino, tamanho, cache = tarefa
+    try:
+        dados = _ler_dados_imagem(imagem_path, zip_path, arquivos_zip)
+    except ERROS_MEMBRO_ZIP as e:
+        return {'erro': f"Corrupted file in ZIP: {imagem_path} ({e})"}
+    if dados is None:
+        return {}
+    return analisar_bytes_imagem(dados, imagem_path, destino, tamanho, cache)
+
+def analisar_bytes_imagem(dados, imagem_path, destino=None, tamanho=TAMANHO_MINIATURA, cache=None):
+    """
+    Hash image bytes already in memory and, when destino is set, write their thumbnail
+    Returns the same dict as the analysis pass of analisar_imagens
+    """
+    resultado = {'sha256': hashlib.sha256(dados).hexdigest()}
+    metadados = ler_metadados(dados)
+    if metadados and metadados.captura:
+        resultado['captura'] = metadados.captura
+    if cache:
+        chave_dhash = cache.chave(resultado['sha256'], 'dhash', TAMANHO_DHASH, tamanho)
+        chave_miniatura = cache.chave(resultado['sha256'], 'miniatura', tamanho, FORMATO_MINIATURA)
+        dhash = cache.obter(chave_dhash)
+        miniatura = cache.obter(chave_miniatura) if destino else None
+        if dhash and (miniatura or not destino):
+            resultado['dhash'] = dhash.decode('ascii')
+            if destino:
+                with open(destino, 'wb') as f:
+                    f.write(miniatura)
+                resultado['miniatura'] = True
+            return resultado
+
+    try:
+        with Image.open(io.BytesIO(dados)) as img:
+            if img.format == 'JPEG':
+                img.draft('RGB', (tamanho, tamanho))
+            miniatura = ImageOps.exif_transpose(img)
+            miniatura.thumbnail((tamanho, tamanho))
+            resultado['dhash'] = _calcular_dhash(miniatura)
+            if destino:
+                if FORMATO_MINIATURA == 'JPEG' and miniatura.mode != 'RGB':
+                    miniatura = miniatura.convert('RGB')
+                elif miniatura.mode not in ('RGB', 'RGBA'):
+                    miniatura = miniatura.convert('RGBA')
+                miniatura.save(destino, FORMATO_MINIATURA, quality=75)
+                resultado['miniatura'] = True
+        if cache:
+            cache.guardar(chave_dhash, resultado['dhash'].encode('ascii'))
+            if destino:
+                with open(destino, 'rb') as f:
+                    cache.guardar(chave_miniatura, f.read())
+    except Exception as e:
+        print(f"Error analyzing image '{imagem_path}': {e}")
+    return resultado
+
+# ZIP archives kept open by each pool worker for its whole lifetime
+_arquivos_zip_worker = {}
+
+def _executar_tarefa_worker(funcao_tarefa):
+    """Process pool entry point"""
+    funcao, tarefa = funcao_tarefa
+    return funcao(tarefa, _arquivos_zip_worker)
+
+def _executar_em_ordem(funcao, tarefas, workers):
+    """
+    Run funcao(tarefa, arquivos_zip) for every task across a process pool
+    Yields results in task order, keeping a bounded window of tasks in flight
+    """
+    workers = min(workers or 1, len(tarefas))
+
+    if workers <= 1:
+        arquivos_zip = {}
+        try:
+            for tarefa in tarefas:
+                yield funcao(tarefa, arquivos_zip)
+        finally:
+            for zip_ref in arquivos_zip.values():
+                zip_ref.close()
+        return
+
+    # spawn avoids forking a process that runs web server and job threads
+    contexto = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=contexto) as executor:
+        restantes = iter(tarefas)
+        pendentes = deque()
+        for tarefa in restantes:
+            pendentes.append(executor.submit(_executar_tarefa_worker, (funcao, tarefa)))
+            if len(pendentes) >= workers * 4:
+                break
+
+        while pendentes:
+            resultado = pendentes.popleft().result()
+            tarefa = next(restantes, None)
+            if tarefa is not None:
+                pendentes.append(executor.submit(_executar_tarefa_worker, (funcao, tarefa)))
+            yield resultado
+
+def _repetir_resultados(chaves, resultados):
+    """
+    Yield one result per key, pulling from resultados only on a key's first
+    occurrence; a result is kept in memory only while its key appears again later
+    """
+    restantes = Counter(chaves)
+    guardados = {}
+    for chave in chaves:
+        resultado = guardados[chave] if chave in guardados else next(resultados)
+        restantes[chave] -= 1
+        if restantes[chave]:
+            guardados[chave] = resultado
+        else:
+            guardados.pop(chave, None)
+        yield resultado
+
+def preparar_imagens(itens, altura_cm, dpi=DPI_PADRAO, qualidade_jpeg=QUALIDADE_JPEG_PADRAO, workers=1,
+                     cache=None):
+    """
+    Decode, measure and prepare image items concurrently across a process pool
+    Yields (bytes, width_px, height_px, error) in the same order as itens
+    Only a bounded window of results is kept ahead of the consumer
+    Items with the same content (item["sha256"]) or source are prepared once
+    With cache (a blob_cache.BlobCache), prepared images are reused across runs
+    """
+    chaves = [item.get("sha256") or (item.get("zip_path"), item["imagem"]) for item in itens]
+    tarefas = {}
+    for item, chave in zip(itens, chaves):
+        if chave not in tarefas:
+            tarefas[chave] = (item["imagem"], item.get("zip_path"), altura_cm, dpi, qualidade_jpeg,
+                              item.get("sha256"), cache)
+    resultados = _executar_em_ordem(_preparar_item, list(tarefas.values()), workers)
+    try:
+        yield from _repetir_resultados(chaves, resultados)
+    finally:
+        if cache:
+            cache.reduzir()
+
+def analisar_imagens(itens, pasta_miniaturas=None, tamanho=TAMANHO_MINIATURA, workers=1, cache=None,
+                     previas=None):
+    """
+    Read every image item once across a process pool, setting on each item:
+    sha256 and dhash (hex) for duplicate detection, captura (EXIF capture time,
+    ISO 8601) when the photo has one, erro when its ZIP member is damaged and,
+    with pasta_miniaturas, miniatura = n for the thumbnail written there as
+    <n><EXTENSAO_MINIATURA>
+    With cache (a blob_cache.BlobCache), thumbnails and hashes are reused across uploads
+    previas maps item["imagem"] to a result computed earlier (see ingestao_zip),
+    whose "miniatura" is the path of its thumbnail; those items are not read again
+    """
+    if pasta_miniaturas:
+        os.makedirs(pasta_miniaturas, exist_ok=True)
+    previas = previas or {}
+    pendentes = []
+    for n, item in enumerate(itens):
+        resultado = dict(previas.get(item["imagem"]) or {})
+        if not resultado:
+            pendentes.append(n)
+            continue
+        miniatura = resultado.pop('miniatura', None)
+        if pasta_miniaturas and miniatura:
+            try:
+                os.replace(miniatura, os.path.join(pasta_miniaturas, f"{n}{EXTENSAO_MINIATURA}"))
+            except OSError:
+                pendentes.append(n)  # Thumbnail already used or gone: analyze again
+                continue
+            item["miniatura"] = n
+        item.update(resultado)
+
+    tarefas = [
+        (itens[n]["imagem"], itens[n].get("zip_path"),
+         os.path.join(pasta_miniaturas, f"{n}{EXTENSAO_MINIATURA}") if pasta_miniaturas else None,
+         tamanho, cache)
+        for n in pendentes
+    ]
+    for n, resultado in zip(pendentes, _executar_em_ordem(_analisar_imagem, tarefas, workers)):
+        item = itens[n]
+        if resultado.pop('miniatura', False):
+            item["miniatura"] = n
+        if 'erro' in resultado:
+            print(f"Error: {resultado['erro']}")
+        item.update(resultado)
+    if cache:
+        cache.reduzir()
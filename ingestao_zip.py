@@ -0,0 +1,265 @@
+import fcntl
+import json
+import os
+import shutil
+import struct
+import threading
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor, wait
+from blob_cache import blob_cache
+from image_utils import analisar_bytes_imagem, EXTENSAO_MINIATURA
+from metrics import ESTAGIO_SEGUNDOS
+from upload_store import upload_store as upload_store_padrao
+from word_utils import EXTENSOES_IMAGEM
+
+# Métodos que sabemos descomprimir a partir dos bytes de um único membro
+METODOS_INCREMENTAIS = (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED)
+
+# Bits de flag do cabeçalho local
+FLAG_CRIPTOGRAFADO = 0x1
+FLAG_DESCRITOR = 0x8
+FLAG_UTF8 = 0x800
+
+# Assinatura opcional do data descriptor que segue os dados de um membro
+ASSINATURA_DESCRITOR = b'PK\x07\x08'
+
+# Bloco lido ao procurar o fim de um membro comprimido com data descriptor
+TAMANHO_BLOCO = 256 * 1024
+
+
+class _FimDaLeitura(Exception):
+    """A leitura incremental não pode continuar (diretório central ou formato não suportado)"""
+
+
+def _campos_zip64(extra, tamanho, tamanho_comprimido):
+    """Tamanhos reais quando o cabeçalho local os guarda no campo extra ZIP64"""
+    posicao = 0
+    while posicao + 4 <= len(extra):
+        tipo, comprimento = struct.unpack_from('<HH', extra, posicao)
+        if tipo == 0x0001:
+            valores = list(struct.unpack_from(f'<{comprimento // 8}Q', extra, posicao + 4))
+            if tamanho == 0xFFFFFFFF and valores:
+                tamanho = valores.pop(0)
+            if tamanho_comprimido == 0xFFFFFFFF and valores:
+                tamanho_comprimido = valores.pop(0)
+            return True, tamanho, tamanho_comprimido
+        posicao += 4 + comprimento
+    return False, tamanho, tamanho_comprimido
+
+
+def _fim_deflate(arquivo, inicio, recebidos):
+    """
+    Tamanho comprimido de um membro deflate cujo cabeçalho não o informa,
+    descomprimindo até o fim do fluxo; None se o fluxo ainda não chegou inteiro
+    """
+    descompressor = zlib.decompressobj(-15)
+    arquivo.seek(inicio)
+    lidos = 0
+    try:
+        while not descompressor.eof and inicio + lidos < recebidos:
+            bloco = arquivo.read(min(TAMANHO_BLOCO, recebidos - inicio - lidos))
+            lidos += len(bloco)
+            descompressor.decompress(bloco)
+    except zlib.error:
+        raise _FimDaLeitura
+    if not descompressor.eof:
+        return None
+    return lidos - len(descompressor.unused_data)
+
+
+def _ler_membro(arquivo, posicao, recebidos):
+    """
+    Membro cujo cabeçalho local começa em posicao, se já recebido por inteiro
+    Retorna None quando faltam bytes; lança _FimDaLeitura quando não há outro
+    cabeçalho local ali ou o membro não pode ser delimitado sem o diretório central
+    """
+    if posicao + zipfile.sizeFileHeader > recebidos:
+        return None
+    arquivo.seek(posicao)
+    cabecalho = arquivo.read(zipfile.sizeFileHeader)
+    if cabecalho[:4] != zipfile.stringFileHeader:
+        raise _FimDaLeitura
+    (_, _, _, flags, metodo, _, _, crc, tamanho_comprimido, tamanho,
+     tamanho_nome, tamanho_extra) = struct.unpack(zipfile.structFileHeader, cabecalho)
+
+    inicio_dados = posicao + zipfile.sizeFileHeader + tamanho_nome + tamanho_extra
+    if inicio_dados > recebidos:
+        return None
+    nome = arquivo.read(tamanho_nome).decode('utf-8' if flags & FLAG_UTF8 else 'cp437')
+    zip64, tamanho, tamanho_comprimido = _campos_zip64(arquivo.read(tamanho_extra), tamanho, tamanho_comprimido)
+
+    if flags & FLAG_DESCRITOR:
+        # Tamanhos e CRC só aparecem depois dos dados: o fluxo deflate indica onde eles acabam
+        if metodo != zipfile.ZIP_DEFLATED:
+            raise _FimDaLeitura
+        tamanho_comprimido = _fim_deflate(arquivo, inicio_dados, recebidos)
+        if tamanho_comprimido is None:
+            return None
+        fim = inicio_dados + tamanho_comprimido
+        formato = '<LQQ' if zip64 else '<LLL'
+        if fim + 4 > recebidos:
+            return None
+        arquivo.seek(fim)
+        if arquivo.read(4) == ASSINATURA_DESCRITOR:
+            fim += 4
+        if fim + struct.calcsize(formato) > recebidos:
+            return None
+        arquivo.seek(fim)
+        crc, tamanho_comprimido, tamanho = struct.unpack(formato, arquivo.read(struct.calcsize(formato)))
+        fim += struct.calcsize(formato)
+    else:
+        fim = inicio_dados + tamanho_comprimido
+        if fim > recebidos:
+            return None
+
+    return {
+        'nome': nome,
+        'flags': flags,
+        'metodo': metodo,
+        'crc': crc,
+        'cabecalho': posicao,
+        'inicio_dados': inicio_dados,
+        'tamanho_comprimido': tamanho_comprimido,
+        'tamanho': tamanho,
+        'fim': fim,
+    }
+
+
+def _analisavel(membro):
+    """Imagem não vazia que pode ser lida sem o restante do arquivo"""
+    return (membro['nome'].lower().endswith(EXTENSOES_IMAGEM)
+            and membro['tamanho'] > 0
+            and not membro['flags'] & FLAG_CRIPTOGRAFADO
+            and membro['metodo'] in METODOS_INCREMENTAIS)
+
+
+class IngestaoZip:
+    """
+    Análise das imagens de um upload em partes enquanto ele ainda é recebido
+    A cada pedaço gravado, avancar() lê os cabeçalhos locais que chegaram e
+    agenda, em threads, o hash e a miniatura de cada imagem já completa
+    Os resultados ficam na pasta previas do upload, em um arquivo por linha,
+    e processar_zip os reaproveita ao final (ver resultados())
+    O estado da leitura fica em disco, então pedaços do mesmo upload podem
+    chegar a workers diferentes do gunicorn
+    """
+
+    def __init__(self, store=None, workers=2, cache=None):
+        self.store = store or upload_store_padrao
+        self.cache = cache
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ingestao')
+        self._pendentes = {}
+        self._lock = threading.Lock()
+
+    def pasta(self, upload_id):
+        """Pasta com o estado da leitura, os resultados e as miniaturas do upload"""
+        return os.path.join(self.store.upload_dir(upload_id), 'previas')
+
+    def avancar(self, upload_id):
+        """
+        Lê os membros recebidos desde a última chamada e agenda a análise das
+        imagens completas; retorna quantas foram agendadas
+        """
+        pasta = self.pasta(upload_id)
+        os.makedirs(pasta, exist_ok=True)
+        membros = []
+        with open(os.path.join(pasta, 'estado.json'), 'a+') as f_estado:
+            fcntl.flock(f_estado, fcntl.LOCK_EX)
+            f_estado.seek(0)
+            estado = json.loads(f_estado.read() or '{}') or {'proximo': 0, 'indice': 0, 'fim': False}
+            if estado['fim']:
+                return 0
+
+            with open(self.store.partial_path(upload_id), 'rb') as arquivo:
+                recebidos = os.fstat(arquivo.fileno()).st_size
+                while True:
+                    try:
+                        membro = _ler_membro(arquivo, estado['proximo'], recebidos)
+                    except _FimDaLeitura:
+                        estado['fim'] = True
+                        break
+                    if membro is None:
+                        break
+                    membro['indice'] = estado['indice']
+                    estado['indice'] += 1
+                    estado['proximo'] = membro['fim']
+                    if _analisavel(membro):
+                        membros.append(membro)
+
+            f_estado.seek(0)
+            f_estado.truncate()
+            json.dump(estado, f_estado)
+
+        with self._lock:
+            pendentes = [f for f in self._pendentes.get(upload_id, ()) if not f.done()]
+            pendentes.extend(self._executor.submit(self._analisar_membro, upload_id, membro)
+                             for membro in membros)
+            self._pendentes[upload_id] = pendentes
+        return len(membros)
+
+    def _analisar_membro(self, upload_id, membro):
+        """Descomprime um membro do arquivo parcial, confere o CRC e registra a análise"""
+        nome = membro['nome']
+        try:
+            pasta = self.pasta(upload_id)
+            with open(self.store.partial_path(upload_id), 'rb') as arquivo:
+                arquivo.seek(membro['inicio_dados'])
+                bruto = arquivo.read(membro['tamanho_comprimido'])
+        except OSError:
+            return  # Upload finalizado ou removido; o processamento final lê o membro
+
+        destino = os.path.join(pasta, f"{membro['indice']}{EXTENSAO_MINIATURA}")
+        with ESTAGIO_SEGUNDOS.time(estagio='analise_no_envio'):
+            try:
+                dados = bruto if membro['metodo'] == zipfile.ZIP_STORED else zlib.decompress(bruto, -15)
+                if zlib.crc32(dados) != membro['crc']:
+                    raise zipfile.BadZipFile(f"Bad CRC-32 for file {nome!r}")
+                resultado = analisar_bytes_imagem(dados, nome, destino, cache=self.cache)
+            except (zipfile.BadZipFile, zlib.error) as e:
+                resultado = {'erro': f"Corrupted file in ZIP: {nome} ({e})"}
+        if resultado.pop('miniatura', False):
+            resultado['miniatura'] = destino
+
+        linha = json.dumps({
+            'nome': nome,
+            'cabecalho': membro['cabecalho'],
+            'crc': membro['crc'],
+            'tamanho_comprimido': membro['tamanho_comprimido'],
+            'resultado': resultado,
+        }, ensure_ascii=False)
+        try:
+            with open(os.path.join(pasta, 'resultados.jsonl'), 'a', encoding='utf-8') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                f.write(linha + '\n')
+        except OSError:
+            pass  # Upload removido durante a análise
+
+    def aguardar(self, upload_id):
+        """Espera as análises deste upload agendadas por este processo"""
+        with self._lock:
+            pendentes = self._pendentes.pop(upload_id, [])
+        wait(pendentes)
+
+    def resultados(self, upload_id):
+        """Análises registradas até agora, por nome do membro"""
+        resultados = {}
+        try:
+            with open(os.path.join(self.pasta(upload_id), 'resultados.jsonl'), encoding='utf-8') as f:
+                for linha in f:
+                    try:
+                        registro = json.loads(linha)
+                    except ValueError:
+                        continue  # Linha sendo gravada por outro processo
+                    resultados[registro['nome']] = registro
+        except OSError:
+            pass
+        return resultados
+
+    def descartar(self, upload_id):
+        """Remove o que sobrou da análise depois do processamento final"""
+        shutil.rmtree(self.pasta(upload_id), ignore_errors=True)
+
+
+# Instância global da ingestão incremental
+ingestao_zip = IngestaoZip(workers=int(os.environ.get('INGESTAO_WORKERS', 2)), cache=blob_cache)
@@ -0,0 +1,159 @@
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from database import database as database_padrao
+from metrics import FALHAS, JOBS_ATIVOS
+
+# Estados possíveis de uma tarefa
+STATUS_QUEUED = 'queued'
+STATUS_RUNNING = 'running'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+
+# Intervalo mínimo entre duas gravações do progresso de uma tarefa no banco
+INTERVALO_PROGRESSO = 1.0
+
+
+class Job:
+    """Tarefa de geração de relatório executada em segundo plano"""
+
+    def __init__(self, total=0, saida=None):
+        self.id = uuid.uuid4().hex
+        self.status = STATUS_QUEUED
+        self.total = total
+        self.saida = saida  # Arquivo gerado pela tarefa, conhecido antes de ela terminar
+        self.done = 0
+        self.result = None
+        self.error = None
+        self.created_at = datetime.now()
+        self.finished_at = None
+
+    @classmethod
+    def from_row(cls, linha):
+        """Cópia de uma tarefa lida do banco, possivelmente de outro worker"""
+        job = cls(total=linha['total'], saida=linha['saida'])
+        job.id = linha['id']
+        job.status = linha['status']
+        job.done = linha['done']
+        job.result = json.loads(linha['resultado']) if linha['resultado'] else None
+        job.error = linha['erro']
+        job.created_at = datetime.fromisoformat(linha['criado_em'])
+        job.finished_at = datetime.fromisoformat(linha['finalizado_em']) if linha['finalizado_em'] else None
+        return job
+
+    def update_progress(self, done, total=None):
+        """Atualiza o número de imagens processadas"""
+        self.done = done
+        if total is not None:
+            self.total = total
+
+    def to_dict(self):
+        """Representação JSON do estado da tarefa"""
+        return {
+            'id': self.id,
+            'status': self.status,
+            'done': self.done,
+            'total': self.total,
+            'error': self.error,
+            'created_at': self.created_at.isoformat(),
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+
+class JobManager:
+    """
+    Gerenciador de tarefas com pool local de workers
+    O estado de cada tarefa também é gravado no banco, então qualquer worker
+    do gunicorn responde sobre ela, não só o que a executa
+    """
+
+    def __init__(self, max_workers=2, retention=timedelta(hours=24), database=None):
+        self.retention = retention
+        self.database = database or database_padrao
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='relatorio')
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, func, *args, total=0, saida=None, **kwargs):
+        """
+        Enfileira func(*args, progresso=callback, **kwargs) e retorna a tarefa
+        O callback recebe (processadas, total) a cada imagem concluída
+        saida é o caminho do arquivo que a tarefa vai gerar, se houver
+        """
+        job = Job(total=total, saida=saida)
+        with self._lock:
+            self._purge_finished()
+            self._jobs[job.id] = job
+        self._gravar(job)
+        self._executor.submit(self._run, job, func, args, kwargs)
+        return job
+
+    def get(self, job_id):
+        """Retorna a tarefa pelo ID ou None; tarefas de outros workers vêm do banco"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            return job
+        linha = self.database.conexao().execute('SELECT * FROM tarefas WHERE id = ?', (job_id,)).fetchone()
+        return Job.from_row(linha) if linha else None
+
+    def _gravar(self, job):
+        """Grava o estado atual da tarefa no banco"""
+        with self.database.transacao() as conexao:
+            conexao.execute(
+                'INSERT OR REPLACE INTO tarefas '
+                '(id, status, total, done, resultado, erro, saida, criado_em, finalizado_em) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (job.id, job.status, job.total, job.done,
+                 json.dumps(job.result, ensure_ascii=False) if job.result is not None else None,
+                 job.error, job.saida, job.created_at.isoformat(),
+                 job.finished_at.isoformat() if job.finished_at else None))
+
+    def _run(self, job, func, args, kwargs):
+        """Executa a tarefa registrando estado, progresso e resultado"""
+        job.status = STATUS_RUNNING
+        JOBS_ATIVOS.inc()
+        self._gravar(job)
+        ultima_gravacao = [time.monotonic()]
+
+        def progresso(done, total=None):
+            job.update_progress(done, total)
+            if time.monotonic() - ultima_gravacao[0] >= INTERVALO_PROGRESSO:
+                ultima_gravacao[0] = time.monotonic()
+                self._gravar(job)
+
+        try:
+            job.result = func(*args, progresso=progresso, **kwargs)
+            job.status = STATUS_DONE
+        except Exception as e:
+            job.error = str(e)
+            job.status = STATUS_FAILED
+            FALHAS.inc(etapa='geracao')
+            print(f"Erro na tarefa {job.id}: {e}")
+        finally:
+            job.finished_at = datetime.now()
+            JOBS_ATIVOS.dec()
+            try:
+                self._gravar(job)
+            except Exception as e:
+                print(f"Erro ao gravar estado da tarefa {job.id}: {e}")
+
+    def _purge_finished(self):
+        """Remove tarefas finalizadas há mais tempo que o período de retenção"""
+        limite = datetime.now() - self.retention
+        expiradas = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished_at and job.finished_at < limite
+        ]
+        for job_id in expiradas:
+            del self._jobs[job_id]
+        with self.database.transacao() as conexao:
+            conexao.execute('DELETE FROM tarefas WHERE finalizado_em < ?', (limite.isoformat(),))
+
+
+# Instância global do gerenciador de tarefas
+job_manager = JobManager(max_workers=int(os.environ.get('JOB_WORKERS', 2)))
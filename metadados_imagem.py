@@ -0,0 +1,253 @@
+import os
+import struct
+import threading
+import zipfile
+import zlib
+from collections import OrderedDict, namedtuple
+from datetime import datetime
+
+# Bytes lidos do início do arquivo a cada tentativa; None lê o arquivo inteiro
+TAMANHOS_LEITURA = (64 * 1024, 1024 * 1024, None)
+
+# Resolução assumida quando o cabeçalho não informa nenhuma (não é a resolução de preparo)
+DPI_SEM_INFORMACAO = 72
+
+# Quantidade máxima de arquivos com metadados em cache
+MAXIMO_CACHE = 4096
+
+# Orientações EXIF que trocam largura e altura
+ORIENTACOES_ROTACIONADAS = (5, 6, 7, 8)
+
+# Marcadores JPEG de início de quadro (SOF), que trazem as dimensões
+MARCADORES_SOF = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+ASSINATURA_JPEG = b'\xff\xd8'
+ASSINATURA_PNG = b'\x89PNG\r\n\x1a\n'
+
+# Erros ao abrir ou ler o início de um arquivo ou membro de ZIP
+ERROS_LEITURA = (OSError, KeyError, zipfile.BadZipFile, zlib.error, EOFError)
+
+
+class MetadadosImagem(namedtuple('MetadadosImagem', 'formato largura altura orientacao dpi captura')):
+    """
+    Cabeçalho de uma imagem: formato ('JPEG' ou 'PNG'), largura e altura em
+    pixels como gravadas, orientação EXIF (1 quando ausente, None quando só
+    decodificando daria para saber), dpi como (horizontal, vertical) e
+    captura, o DateTimeOriginal do EXIF em ISO 8601 (None quando ausente)
+    """
+    __slots__ = ()
+
+    @property
+    def tamanho_exibido(self):
+        """(largura, altura) depois de aplicar a orientação EXIF"""
+        if self.orientacao in ORIENTACOES_ROTACIONADAS:
+            return self.altura, self.largura
+        return self.largura, self.altura
+
+
+class _FaltamBytes(Exception):
+    """O cabeçalho continua além dos bytes disponíveis"""
+
+
+def ler_metadados(dados):
+    """Metadados a partir do início dos bytes de uma imagem JPEG ou PNG, ou None"""
+    try:
+        return _ler(dados)
+    except _FaltamBytes:
+        return None
+
+
+def _ler(dados):
+    try:
+        if dados[:2] == ASSINATURA_JPEG:
+            return _ler_jpeg(dados)
+        if dados[:8] == ASSINATURA_PNG:
+            return _ler_png(dados)
+    except (struct.error, IndexError):
+        raise _FaltamBytes
+    if len(dados) < len(ASSINATURA_PNG):
+        raise _FaltamBytes
+    return None
+
+
+def _dpi(x, y, fator=1):
+    """Par de dpi inteiros, ou None se o arquivo não informa valores válidos"""
+    dpi = round(x * fator), round(y * fator)
+    return dpi if dpi[0] > 0 and dpi[1] > 0 else None
+
+
+def _data_exif(tiff, ordem, ifd):
+    """DateTimeOriginal do sub-IFD EXIF em ISO 8601, ou None se ausente ou inválido"""
+    for n in range(struct.unpack_from(ordem + 'H', tiff, ifd)[0]):
+        entrada = ifd + 2 + 12 * n
+        tag, _, quantidade, deslocamento = struct.unpack_from(ordem + 'HHLL', tiff, entrada)
+        if tag == 0x9003:
+            texto = tiff[deslocamento:deslocamento + min(quantidade, 19)]
+            try:
+                return datetime.strptime(texto.decode('ascii'), '%Y:%m:%d %H:%M:%S').isoformat()
+            except ValueError:
+                return None  # Data em branco ('0000:00:00 00:00:00') ou ilegível
+    return None
+
+
+def _ler_exif(tiff):
+    """
+    (orientação, dpi, captura) de um bloco EXIF (cabeçalho TIFF): orientação e
+    dpi vêm do IFD0, captura do sub-IFD EXIF; orientação None se ilegível
+    """
+    try:
+        if tiff[:2] not in (b'II', b'MM'):
+            return None, None, None
+        ordem = '<' if tiff[:2] == b'II' else '>'
+        ifd = struct.unpack_from(ordem + 'L', tiff, 4)[0]
+        orientacao, resolucao, unidade, sub_ifd = 1, {}, 2, None
+        for n in range(struct.unpack_from(ordem + 'H', tiff, ifd)[0]):
+            entrada = ifd + 2 + 12 * n
+            tag = struct.unpack_from(ordem + 'H', tiff, entrada)[0]
+            if tag == 0x0112:
+                orientacao = struct.unpack_from(ordem + 'H', tiff, entrada + 8)[0]
+            elif tag in (0x011A, 0x011B):
+                deslocamento = struct.unpack_from(ordem + 'L', tiff, entrada + 8)[0]
+                numerador, denominador = struct.unpack_from(ordem + 'LL', tiff, deslocamento)
+                resolucao[tag] = numerador / denominador if denominador else 0
+            elif tag == 0x0128:
+                unidade = struct.unpack_from(ordem + 'H', tiff, entrada + 8)[0]
+            elif tag == 0x8769:
+                sub_ifd = struct.unpack_from(ordem + 'L', tiff, entrada + 8)[0]
+    except struct.error:
+        return None, None, None
+    try:
+        captura = _data_exif(tiff, ordem, sub_ifd) if sub_ifd else None
+    except struct.error:
+        captura = None
+    fator = {2: 1, 3: 2.54}.get(unidade)
+    if fator is None or len(resolucao) < 2:
+        return orientacao, None, captura
+    return orientacao, _dpi(resolucao[0x011A], resolucao[0x011B], fator), captura
+
+
+def _ler_jpeg(dados):
+    """Percorre os segmentos até o SOF; APP0 (JFIF) e APP1 (EXIF) dão dpi e orientação"""
+    posicao = 2
+    orientacao, dpi_jfif, dpi_exif, captura, exif_lido = 1, None, None, None, False
+    while True:
+        if posicao + 4 > len(dados):
+            raise _FaltamBytes
+        if dados[posicao] != 0xFF:
+            return None
+        marcador = dados[posicao + 1]
+        if marcador == 0xFF:
+            posicao += 1  # Byte de preenchimento
+            continue
+        if marcador == 0x01 or 0xD0 <= marcador <= 0xD7:
+            posicao += 2  # Marcadores sem segmento
+            continue
+        if marcador in (0xD9, 0xDA):
+            return None  # Dados da imagem antes de qualquer SOF
+
+        fim = posicao + 2 + struct.unpack_from('>H', dados, posicao + 2)[0]
+        if marcador in MARCADORES_SOF:
+            altura, largura = struct.unpack_from('>HH', dados, posicao + 5)
+            return MetadadosImagem('JPEG', largura, altura, orientacao,
+                                   dpi_jfif or dpi_exif or (DPI_SEM_INFORMACAO, DPI_SEM_INFORMACAO), captura)
+        if marcador in (0xE0, 0xE1) and fim > len(dados):
+            raise _FaltamBytes
+        if marcador == 0xE0 and dados[posicao + 4:posicao + 9] == b'JFIF\x00':
+            unidade = dados[posicao + 11]
+            x, y = struct.unpack_from('>HH', dados, posicao + 12)
+            dpi_jfif = _dpi(x, y, {1: 1, 2: 2.54}.get(unidade, 0))
+        elif marcador == 0xE1 and dados[posicao + 4:posicao + 10] == b'Exif\x00\x00' and not exif_lido:
+            orientacao, dpi_exif, captura = _ler_exif(dados[posicao + 10:fim])
+            exif_lido = True
+        posicao = fim
+
+
+def _ler_png(dados):
+    """Percorre os chunks até o IDAT: IHDR dá o tamanho, pHYs o dpi e eXIf a orientação"""
+    posicao = len(ASSINATURA_PNG)
+    tamanho, orientacao, dpi, captura = None, 1, None, None
+    while True:
+        if posicao + 8 > len(dados):
+            raise _FaltamBytes
+        comprimento, tipo = struct.unpack_from('>L4s', dados, posicao)
+        inicio = posicao + 8
+        if tipo == b'IHDR':
+            tamanho = struct.unpack_from('>LL', dados, inicio)
+        elif tipo == b'pHYs':
+            x, y, unidade = struct.unpack_from('>LLB', dados, inicio)
+            if unidade == 1:
+                dpi = _dpi(x, y, 0.0254)
+        elif tipo == b'eXIf':
+            if inicio + comprimento > len(dados):
+                raise _FaltamBytes
+            orientacao, _, captura = _ler_exif(dados[inicio:inicio + comprimento])
+        elif tipo in (b'tEXt', b'zTXt', b'iTXt') and dados[inicio:inicio + 21] == b'Raw profile type exif':
+            orientacao = None  # EXIF em texto codificado: só o Pillow sabe lê-lo
+        elif tipo in (b'IDAT', b'IEND'):
+            if tamanho is None:
+                return None
+            return MetadadosImagem('PNG', tamanho[0], tamanho[1], orientacao,
+                                   dpi or (DPI_SEM_INFORMACAO, DPI_SEM_INFORMACAO), captura)
+        posicao = inicio + comprimento + 4
+
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def metadados_arquivo(caminho, membro=None, arquivos_zip=None):
+    """
+    Metadados de um arquivo de imagem, ou do membro membro do ZIP caminho,
+    lendo só o início dele; None se não for um JPEG/PNG legível
+    O resultado fica em cache enquanto tamanho e data do arquivo não mudam
+    arquivos_zip guarda, por caminho, os ZIPs abertos para reaproveitá-los;
+    quem o passa fecha os arquivos ao final
+    """
+    try:
+        estado = os.stat(caminho)
+    except OSError:
+        return None
+    chave = (caminho, membro, estado.st_size, estado.st_mtime_ns)
+    with _cache_lock:
+        if chave in _cache:
+            _cache.move_to_end(chave)
+            return _cache[chave]
+
+    if arquivos_zip is None:
+        arquivos_zip = {}
+        try:
+            metadados = _ler_arquivo(caminho, membro, arquivos_zip)
+        finally:
+            for zip_ref in arquivos_zip.values():
+                zip_ref.close()
+    else:
+        metadados = _ler_arquivo(caminho, membro, arquivos_zip)
+    with _cache_lock:
+        _cache[chave] = metadados
+        while len(_cache) > MAXIMO_CACHE:
+            _cache.popitem(last=False)
+    return metadados
+
+
+def _ler_arquivo(caminho, membro, arquivos_zip):
+    """Lê blocos crescentes do início do arquivo até o cabeçalho estar completo"""
+    try:
+        if membro is None:
+            arquivo = open(caminho, 'rb')
+        else:
+            zip_ref = arquivos_zip.get(caminho)
+            if zip_ref is None:
+                zip_ref = arquivos_zip[caminho] = zipfile.ZipFile(caminho, 'r')
+            arquivo = zip_ref.open(membro)
+        with arquivo:
+            dados = b''
+            for tamanho in TAMANHOS_LEITURA:
+                dados += arquivo.read(tamanho - len(dados) if tamanho else -1)
+                try:
+                    return _ler(dados)
+                except _FaltamBytes:
+                    if tamanho is None or len(dados) < tamanho:
+                        return None  # Arquivo acabou antes do cabeçalho
+    except ERROS_LEITURA:
+        return None
+    return None
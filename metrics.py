@@ -0,0 +1,206 @@
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+# Limites padrão dos histogramas de duração, em segundos
+BUCKETS_PADRAO = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _escapar(valor):
+    """Escapa o valor de um rótulo no formato de texto do Prometheus"""
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _rotulos(nomes, valores, extra=None):
+    """Formata {nome="valor",...} para uma série"""
+    pares = [f'{nome}="{_escapar(valor)}"' for nome, valor in zip(nomes, valores)]
+    if extra:
+        pares.append(extra)
+    return '{' + ','.join(pares) + '}' if pares else ''
+
+
+def _numero(valor):
+    """Formata um número como o Prometheus espera (inteiros sem casa decimal)"""
+    if valor == float('inf'):
+        return '+Inf'
+    return str(int(valor)) if float(valor).is_integer() else repr(float(valor))
+
+
+class _Metrica:
+    """Base das métricas: nome, descrição, rótulos e trava"""
+
+    tipo = None
+
+    def __init__(self, nome, descricao, rotulos=()):
+        self.nome = nome
+        self.descricao = descricao
+        self.rotulos = tuple(rotulos)
+        self._lock = threading.Lock()
+
+    def _chave(self, valores):
+        if set(valores) != set(self.rotulos):
+            raise ValueError(f"Rótulos de {self.nome} devem ser {self.rotulos}")
+        return tuple(valores[nome] for nome in self.rotulos)
+
+    def _cabecalho(self):
+        return [f"# HELP {self.nome} {self.descricao}", f"# TYPE {self.nome} {self.tipo}"]
+
+
+class Counter(_Metrica):
+    """Contador que só cresce"""
+
+    tipo = 'counter'
+
+    def __init__(self, nome, descricao, rotulos=()):
+        super().__init__(nome, descricao, rotulos)
+        self._valores = defaultdict(float)
+
+    def inc(self, quantidade=1, **rotulos):
+        with self._lock:
+            self._valores[self._chave(rotulos)] += quantidade
+
+    def valor(self, **rotulos):
+        with self._lock:
+            return self._valores.get(self._chave(rotulos), 0)
+
+    def exportar(self):
+        with self._lock:
+            series = sorted(self._valores.items())
+        return self._cabecalho() + [
+            f"{self.nome}{_rotulos(self.rotulos, chave)} {_numero(valor)}" for chave, valor in series
+        ]
+
+
+class Gauge(Counter):
+    """Valor que sobe e desce"""
+
+    tipo = 'gauge'
+
+    def dec(self, quantidade=1, **rotulos):
+        self.inc(-quantidade, **rotulos)
+
+    def set(self, valor, **rotulos):
+        with self._lock:
+            self._valores[self._chave(rotulos)] = valor
+
+
+class Histogram(_Metrica):
+    """Distribuição de valores em faixas cumulativas, com soma e contagem"""
+
+    tipo = 'histogram'
+
+    def __init__(self, nome, descricao, rotulos=(), buckets=BUCKETS_PADRAO):
+        super().__init__(nome, descricao, rotulos)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._series = {}
+
+    def observe(self, valor, **rotulos):
+        chave = self._chave(rotulos)
+        with self._lock:
+            serie = self._series.get(chave)
+            if serie is None:
+                serie = self._series[chave] = {'buckets': [0] * len(self.buckets), 'soma': 0.0, 'contagem': 0}
+            for i, limite in enumerate(self.buckets):
+                if valor <= limite:
+                    serie['buckets'][i] += 1
+                    break
+            serie['soma'] += valor
+            serie['contagem'] += 1
+
+    @contextmanager
+    def time(self, **rotulos):
+        """Observa a duração do bloco em segundos"""
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - inicio, **rotulos)
+
+    def exportar(self):
+        with self._lock:
+            series = sorted((chave, dict(serie, buckets=list(serie['buckets'])))
+                            for chave, serie in self._series.items())
+        linhas = self._cabecalho()
+        for chave, serie in series:
+            acumulado = 0
+            for limite, quantidade in zip(self.buckets, serie['buckets']):
+                acumulado += quantidade
+                le = f'le="{_numero(limite)}"'
+                linhas.append(f"{self.nome}_bucket{_rotulos(self.rotulos, chave, le)} {acumulado}")
+            linhas.append(f"{self.nome}_sum{_rotulos(self.rotulos, chave)} {_numero(serie['soma'])}")
+            linhas.append(f"{self.nome}_count{_rotulos(self.rotulos, chave)} {serie['contagem']}")
+        return linhas
+
+
+class Cronometro:
+    """
+    Acumula o tempo gasto em cada estágio de uma execução e registra os totais
+    de uma vez no histograma, uma observação por estágio
+    """
+
+    def __init__(self, histograma):
+        self.histograma = histograma
+        self.totais = defaultdict(float)
+
+    @contextmanager
+    def medir(self, estagio):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.totais[estagio] += time.perf_counter() - inicio
+
+    def registrar(self):
+        for estagio, total in self.totais.items():
+            self.histograma.observe(total, estagio=estagio)
+        self.totais.clear()
+
+
+class Registry:
+    """Conjunto de métricas exportadas no formato de texto do Prometheus"""
+
+    def __init__(self):
+        self._metricas = {}
+        self._lock = threading.Lock()
+
+    def _registrar(self, metrica):
+        with self._lock:
+            if metrica.nome in self._metricas:
+                raise ValueError(f"Métrica já registrada: {metrica.nome}")
+            self._metricas[metrica.nome] = metrica
+        return metrica
+
+    def counter(self, nome, descricao, rotulos=()):
+        return self._registrar(Counter(nome, descricao, rotulos))
+
+    def gauge(self, nome, descricao, rotulos=()):
+        return self._registrar(Gauge(nome, descricao, rotulos))
+
+    def histogram(self, nome, descricao, rotulos=(), buckets=BUCKETS_PADRAO):
+        return self._registrar(Histogram(nome, descricao, rotulos, buckets))
+
+    def exportar(self):
+        """Texto de todas as métricas, pronto para o endpoint /metrics"""
+        with self._lock:
+            metricas = list(self._metricas.values())
+        return '\n'.join(linha for metrica in metricas for linha in metrica.exportar()) + '\n'
+
+
+# Registro global; cada processo (worker do gunicorn) mantém seus próprios valores
+registry = Registry()
+
+ESTAGIO_SEGUNDOS = registry.histogram(
+    'relatorios_estagio_segundos', 'Duração de cada estágio do processamento, por execução', ['estagio'])
+IMAGENS = registry.counter(
+    'relatorios_imagens_total', 'Imagens processadas, por resultado', ['resultado'])
+BYTES = registry.counter(
+    'relatorios_bytes_total', 'Bytes recebidos e gerados, por tipo', ['tipo'])
+FALHAS = registry.counter(
+    'relatorios_falhas_total', 'Falhas, por etapa', ['etapa'])
+RELATORIOS_GERADOS = registry.counter(
+    'relatorios_gerados_total', 'Relatórios gerados com sucesso')
+JOBS_ATIVOS = registry.gauge(
+    'relatorios_jobs_ativos', 'Tarefas de geração em execução')
+REQUISICAO_SEGUNDOS = registry.histogram(
+    'relatorios_http_requisicao_segundos', 'Latência das requisições HTTP', ['metodo', 'rota', 'status'])
@@ -0,0 +1,181 @@
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from database import database as database_padrao
+from docx_streaming import SUFIXO_PARCIAL
+
+# Intervalo mínimo entre duas aplicações da política de retenção
+INTERVALO_LIMPEZA = timedelta(minutes=10)
+
+# Colunas de cada relatório no banco
+CAMPOS = ('arquivo', 'projeto', 'modelo', 'imagens', 'tamanho', 'criado_em')
+
+
+class OutputStore:
+    """
+    Relatórios gerados, com os metadados de cada um na tabela relatorios
+    Consultas usam os índices do banco, sem percorrer o diretório, e podem
+    vir de vários processos ao mesmo tempo
+    Relatórios mais antigos que max_idade são removidos, e os mais antigos
+    também quando o total passa de tamanho_maximo bytes (None desativa)
+    Relatórios em base_dir sem registro (gerados antes do banco existir ou
+    copiados à mão) são registrados ao iniciar e a cada limpeza, com a data
+    do arquivo, e passam a seguir a mesma retenção
+    """
+
+    def __init__(self, base_dir='output', max_idade=timedelta(hours=24), tamanho_maximo=None, database=None):
+        self.base_dir = base_dir
+        self.max_idade = max_idade
+        self.tamanho_maximo = tamanho_maximo
+        self.database = database or database_padrao
+        self._ultima_limpeza = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.base_dir, exist_ok=True)
+        self._register_existing()
+
+    def unique_path(self, nome):
+        """Caminho para um novo relatório: nome com data e um sufixo aleatório"""
+        base, extensao = os.path.splitext(nome)
+        sufixo = f"{datetime.now():%Y-%m-%d %H%M%S} {uuid.uuid4().hex[:6]}"
+        return os.path.join(self.base_dir, f"{base} - {sufixo}{extensao}")
+
+    def register(self, output_path, projeto=None, modelo=None, imagens=None):
+        """
+        Registra um relatório já gravado em output_path, com tamanho e data,
+        e depois aplica a política de retenção. Retorna a entrada
+        """
+        entrada = {
+            'arquivo': os.path.basename(output_path),
+            'projeto': projeto,
+            'modelo': modelo,
+            'imagens': imagens,
+            'tamanho': os.path.getsize(output_path),
+            'criado_em': datetime.now().isoformat(timespec='seconds'),
+        }
+        with self.database.transacao() as conexao:
+            conexao.execute(
+                f"INSERT OR REPLACE INTO relatorios ({', '.join(CAMPOS)}) VALUES ({', '.join('?' * len(CAMPOS))})",
+                [entrada[campo] for campo in CAMPOS])
+            removidos = self._apply_retention(conexao, preservar=entrada['arquivo'])
+        self._delete_files(removidos)
+        self._ultima_limpeza = time.monotonic()
+        return entrada
+
+    def get(self, nome):
+        """Entrada do relatório pelo nome do arquivo, ou None"""
+        linha = self.database.conexao().execute(
+            'SELECT * FROM relatorios WHERE arquivo = ?', (nome,)).fetchone()
+        return dict(linha) if linha else None
+
+    def list(self, projeto=None, limite=None):
+        """Entradas das mais recentes para as mais antigas, opcionalmente de um projeto"""
+        self._sweep_if_due()
+        consulta, parametros = 'SELECT * FROM relatorios', []
+        if projeto is not None:
+            consulta += ' WHERE projeto = ?'
+            parametros.append(projeto)
+        consulta += ' ORDER BY criado_em DESC'
+        if limite is not None:
+            consulta += ' LIMIT ?'
+            parametros.append(limite)
+        return [dict(linha) for linha in self.database.conexao().execute(consulta, parametros)]
+
+    def disk_usage(self):
+        """Bytes ocupados pelos relatórios registrados"""
+        return self.database.conexao().execute('SELECT COALESCE(SUM(tamanho), 0) FROM relatorios').fetchone()[0]
+
+    def delete(self, nome):
+        """Remove o relatório e seu registro"""
+        with self.database.transacao() as conexao:
+            conexao.execute('DELETE FROM relatorios WHERE arquivo = ?', (nome,))
+        self._delete_files([nome])
+
+    def _delete_files(self, nomes):
+        for nome in nomes:
+            try:
+                os.remove(os.path.join(self.base_dir, nome))
+            except OSError:
+                pass  # Já removido
+
+    def _apply_retention(self, conexao, preservar=None):
+        """
+        Apaga os registros expirados e, se preciso, os mais antigos, dentro da
+        transação de conexao; retorna os nomes cujos arquivos devem ser removidos
+        preservar é o relatório recém-gerado, mantido mesmo se sozinho exceder o limite
+        """
+        limite = (datetime.now() - self.max_idade).isoformat(timespec='seconds')
+        removidos = [linha['arquivo'] for linha in conexao.execute(
+            'SELECT arquivo FROM relatorios WHERE criado_em < ? AND arquivo IS NOT ?', (limite, preservar))]
+
+        if self.tamanho_maximo is not None:
+            total = conexao.execute(
+                'SELECT COALESCE(SUM(tamanho), 0) FROM relatorios WHERE criado_em >= ?', (limite,)).fetchone()[0]
+            if total > self.tamanho_maximo:
+                for linha in conexao.execute(
+                        'SELECT arquivo, tamanho FROM relatorios WHERE criado_em >= ? AND arquivo IS NOT ? '
+                        'ORDER BY criado_em', (limite, preservar)).fetchall():
+                    if total <= self.tamanho_maximo:
+                        break
+                    removidos.append(linha['arquivo'])
+                    total -= linha['tamanho']
+
+        conexao.executemany('DELETE FROM relatorios WHERE arquivo = ?', [(nome,) for nome in removidos])
+        return removidos
+
+    def _register_existing(self):
+        """Registra os relatórios de base_dir que ainda não estão no banco"""
+        entradas = []
+        with os.scandir(self.base_dir) as arquivos:
+            for e in arquivos:
+                if not e.name.endswith('.docx') or not e.is_file():
+                    continue
+                try:
+                    estado = e.stat()
+                except OSError:
+                    continue  # Removido por outro processo
+                entradas.append((e.name, estado.st_size,
+                                 datetime.fromtimestamp(estado.st_mtime).isoformat(timespec='seconds')))
+        if not entradas:
+            return
+        # OR IGNORE: um relatório registrado por register() mantém seus metadados
+        with self.database.transacao() as conexao:
+            conexao.executemany(
+                'INSERT OR IGNORE INTO relatorios (arquivo, tamanho, criado_em) VALUES (?, ?, ?)', entradas)
+
+    def _delete_expired_partials(self):
+        """Remove arquivos parciais de gerações interrompidas há mais que max_idade"""
+        limite = time.time() - self.max_idade.total_seconds()
+        with os.scandir(self.base_dir) as entradas:
+            for e in entradas:
+                try:
+                    if e.name.endswith(SUFIXO_PARCIAL) and e.stat().st_mtime < limite:
+                        os.remove(e.path)
+                except OSError:
+                    pass  # Concluído ou removido por outro processo
+
+    def sweep(self):
+        """Aplica a política de retenção; retorna quantos relatórios foram removidos"""
+        self._register_existing()
+        with self.database.transacao() as conexao:
+            removidos = self._apply_retention(conexao)
+        self._delete_files(removidos)
+        self._delete_expired_partials()
+        self._ultima_limpeza = time.monotonic()
+        return len(removidos)
+
+    def _sweep_if_due(self):
+        """Executa sweep() no máximo uma vez a cada INTERVALO_LIMPEZA"""
+        with self._lock:
+            if time.monotonic() - self._ultima_limpeza < INTERVALO_LIMPEZA.total_seconds():
+                return
+            self._ultima_limpeza = time.monotonic()
+        self.sweep()
+
+
+# Instância global dos relatórios gerados
+output_store = OutputStore(
+    max_idade=timedelta(hours=float(os.environ.get('OUTPUT_TTL_HOURS', 24))),
+    tamanho_maximo=int(os.environ.get('OUTPUT_QUOTA_MB', 5 * 1024)) * 1024 * 1024
+)
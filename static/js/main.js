@@ -53,10 +53,109 @@ document.addEventListener('DOMContentLoaded', function() {
         // Show loading state
         showLoadingState();
         
+        // Send the ZIP in chunks when the browser supports it
+        const file = fileInput.files[0];
+        if (window.fetch && file && file.slice) {
+            e.preventDefault();
+            uploadInChunks(file).catch(error => {
+                showNotification(error.message, 'error');
+                resetLoadingState();
+            });
+            return;
+        }
+        
         // Simulate progress (since we can't track actual server progress)
         simulateProgress();
     });
     
+    // Form fields without the file input
+    function buildFieldsData() {
+        const data = new FormData(form);
+        data.delete('arquivo_zip');
+        return data;
+    }
+    
+    // Parse a JSON response, turning server errors into exceptions
+    function readJson(response) {
+        return response.json().then(data => {
+            if (!response.ok && response.status !== 409) {
+                throw new Error(data.error || 'Erro ao enviar arquivo');
+            }
+            data.status = response.status;
+            return data;
+        });
+    }
+    
+    // Upload the ZIP in chunks, resuming after failures and page reloads
+    async function uploadInChunks(file) {
+        const resumeKey = `upload:${file.name}:${file.size}:${file.lastModified}`;
+        let upload = JSON.parse(localStorage.getItem(resumeKey) || 'null');
+        let offset = 0;
+        
+        // Resume a previous upload of the same file when the server still has it
+        if (upload) {
+            const response = await fetch(upload.chunk_url).catch(() => null);
+            if (response && response.ok) {
+                offset = (await response.json()).offset;
+            } else {
+                upload = null;
+            }
+        }
+        
+        if (!upload) {
+            const data = buildFieldsData();
+            data.append('filename', file.name);
+            data.append('size', file.size);
+            upload = await readJson(await fetch(form.dataset.chunkUrl, { method: 'POST', body: data }));
+            localStorage.setItem(resumeKey, JSON.stringify(upload));
+        }
+        
+        let failures = 0;
+        while (offset < file.size) {
+            updateProgress(offset, file.size);
+            try {
+                const chunk = file.slice(offset, offset + upload.chunk_size);
+                const response = await fetch(upload.chunk_url, {
+                    method: 'PUT',
+                    headers: { 'Upload-Offset': String(offset), 'Content-Type': 'application/octet-stream' },
+                    body: chunk
+                });
+                // 409 carries the offset the server expects next
+                offset = (await readJson(response)).offset;
+                failures = 0;
+            } catch (error) {
+                if (++failures > 5) {
+                    throw new Error('Falha no envio. Tente novamente para continuar de onde parou.');
+                }
+                await new Promise(resolve => setTimeout(resolve, 1000 * 2 ** failures));
+                const response = await fetch(upload.chunk_url).catch(() => null);
+                if (response && response.ok) {
+                    offset = (await response.json()).offset;
+                }
+            }
+        }
+        
+        updateProgress(file.size, file.size);
+        progressText.textContent = 'Processando imagens...';
+        const response = await fetch(upload.finalize_url, { method: 'POST', body: buildFieldsData() });
+        // The server discards the upload once it has been processed or rejected
+        if (response.status !== 409) {
+            localStorage.removeItem(resumeKey);
+        }
+        const result = await readJson(response);
+        if (!result.redirect) {
+            throw new Error(result.error || 'Erro ao processar arquivo');
+        }
+        window.location.href = result.redirect;
+    }
+    
+    // Show real upload progress
+    function updateProgress(sent, total) {
+        const progress = total ? Math.floor(sent * 100 / total) : 100;
+        progressBar.style.width = progress + '%';
+        progressText.textContent = progress + '%';
+    }
+    
     // Form validation function
     function validateForm() {
         const requiredFields = form.querySelectorAll('[required]');
@@ -89,12 +188,21 @@ document.addEventListener('DOMContentLoaded', function() {
     
     // Show loading state
     function showLoadingState() {
+        btnText.dataset.originalText = btnText.dataset.originalText || btnText.innerHTML;
         submitBtn.disabled = true;
         submitBtn.classList.add('loading');
         btnText.innerHTML = '<i class="fas fa-spinner fa-spin mr-2"></i>Processando...';
         progressContainer.classList.remove('hidden');
     }
     
+    // Restore the form after a failed upload
+    function resetLoadingState() {
+        submitBtn.disabled = false;
+        submitBtn.classList.remove('loading');
+        btnText.innerHTML = btnText.dataset.originalText;
+        progressContainer.classList.add('hidden');
+    }
+    
     // Simulate progress
     function simulateProgress() {
         let progress = 0;
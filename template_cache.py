@@ -0,0 +1,152 @@
+import copy
+import os
+import threading
+from docx import Document
+from docx.opc.constants import CONTENT_TYPE as CT
+from docx.opc.part import XmlPart
+from docx.oxml.ns import qn
+from docx.shared import lazyproperty
+from docx.text.paragraph import Paragraph
+
+# Marcador do ponto de inserção do conteúdo nos modelos
+MARCADOR_INSERCAO = "{{start_here}}"
+
+# Partes do pacote que podem conter placeholders: corpo, cabeçalhos e rodapés
+TIPOS_PARTE_TEXTO = (CT.WML_DOCUMENT_MAIN, CT.WML_HEADER, CT.WML_FOOTER)
+
+
+def partes_texto(doc):
+    """Retorna as partes XML com texto do documento: corpo, cabeçalhos e rodapés"""
+    return [parte for parte in doc.part.package.iter_parts() if parte.content_type in TIPOS_PARTE_TEXTO]
+
+
+def paragrafos_com_placeholders(doc):
+    """
+    Localiza os parágrafos que contêm '{{' em todas as partes de texto
+    Inclui tabelas, tabelas aninhadas e caixas de texto
+    Retorna lista de (parte, elemento w:p)
+    """
+    return [
+        (parte, p)
+        for parte in partes_texto(doc)
+        for p in parte.element.iter(qn('w:p'))
+        if '{{' in Paragraph(p, None).text
+    ]
+
+
+def _atributos_proprios(parte):
+    """
+    Atributos de instância da parte sem os valores guardados por lazyproperty,
+    que apontam para objetos do pacote original e são recalculados na cópia
+    """
+    preguicosos = {'_rels'}  # Cópia legada de rels que o python-docx também guarda
+    for classe in type(parte).__mro__:
+        preguicosos.update(nome for nome, valor in vars(classe).items() if isinstance(valor, lazyproperty))
+    return {nome: valor for nome, valor in vars(parte).items() if nome not in preguicosos}
+
+
+def clonar_documento(doc):
+    """
+    Cópia do documento para um relatório, sem copiar o pacote inteiro
+    Cada parte ganha um objeto novo com relações próprias, mas só os elementos
+    XML do corpo, dos cabeçalhos e dos rodapés (os que recebem placeholders e
+    imagens) são duplicados; estilos, tema, numeração e a mídia do modelo são
+    compartilhados com o original, que nenhum relatório altera
+    """
+    original = doc.part.package
+    pacote = type(original)()
+    copias = {}
+    for parte in original.iter_parts():
+        copia = object.__new__(type(parte))
+        vars(copia).update(_atributos_proprios(parte))
+        copia._package = pacote
+        if isinstance(parte, XmlPart) and parte.content_type in TIPOS_PARTE_TEXTO:
+            copia._element = copy.deepcopy(parte._element)
+        copias[parte] = copia
+
+    def copiar_relacoes(origem, destino):
+        for rel in origem.values():
+            alvo = rel.target_ref if rel.is_external else copias[rel.target_part]
+            destino.add_relationship(rel.reltype, alvo, rel.rId, rel.is_external)
+
+    copiar_relacoes(original.rels, pacote.rels)
+    for parte, copia in copias.items():
+        copiar_relacoes(parte.rels, copia.rels)
+    pacote.after_unmarshal()  # Coleção de imagens do pacote novo
+    return pacote.main_document_part.document
+
+
+class ModeloCompilado:
+    """Modelo .docx já analisado, com placeholders e ponto de inserção localizados"""
+
+    def __init__(self, modelo_path):
+        self.mtime = os.stat(modelo_path).st_mtime_ns
+        self.doc = Document(modelo_path)
+
+        # Posição de cada w:p na ordem do documento, por parte; a cópia tem a mesma ordem
+        posicoes = {
+            p: (str(parte.partname), indice)
+            for parte in partes_texto(self.doc)
+            for indice, p in enumerate(parte.element.iter(qn('w:p')))
+        }
+
+        # Parágrafos que contêm algum placeholder
+        self.posicoes_placeholders = [posicoes[p] for parte, p in paragrafos_com_placeholders(self.doc)]
+
+        # Parágrafo com o marcador de inserção, se existir
+        self.posicao_ancora = None
+        for paragrafo in self.doc.paragraphs:
+            if MARCADOR_INSERCAO in paragrafo.text:
+                self.posicao_ancora = posicoes[paragrafo._p]
+                break
+
+    def instanciar(self):
+        """
+        Retorna uma cópia independente do modelo para um relatório
+        Retorna (doc, parágrafos com placeholders, parágrafo âncora ou None)
+        """
+        doc = clonar_documento(self.doc)
+        partes = {str(parte.partname): parte for parte in partes_texto(doc)}
+        elementos = {}
+
+        def localizar(posicao):
+            partname, indice = posicao
+            parte = partes[partname]
+            if partname not in elementos:
+                elementos[partname] = list(parte.element.iter(qn('w:p')))
+            # Apenas parágrafos do corpo resolvem estilos pelo elemento pai
+            return Paragraph(elementos[partname][indice], doc._body if parte is doc.part else None)
+
+        paragrafos = [localizar(posicao) for posicao in self.posicoes_placeholders]
+        ancora = localizar(self.posicao_ancora) if self.posicao_ancora else None
+        return doc, paragrafos, ancora
+
+
+class TemplateCache:
+    """Cache em memória dos modelos compilados, por caminho e data de modificação"""
+
+    def __init__(self):
+        self._modelos = {}
+        self._lock = threading.Lock()
+
+    def obter(self, modelo_path):
+        """Retorna (doc, parágrafos com placeholders, âncora) de uma cópia do modelo"""
+        chave = os.path.abspath(modelo_path)
+        mtime = os.stat(chave).st_mtime_ns
+
+        with self._lock:
+            modelo = self._modelos.get(chave)
+            if modelo is None or modelo.mtime != mtime:
+                modelo = ModeloCompilado(chave)
+                self._modelos[chave] = modelo
+
+        return modelo.instanciar()
+
+    def limpar(self):
+        """Descarta todos os modelos em cache"""
+        with self._lock:
+            self._modelos.clear()
+
+
+# Instância global do cache de modelos
+template_cache = TemplateCache()
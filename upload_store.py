@@ -0,0 +1,195 @@
+import fcntl
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from database import database as database_padrao
+
+# IDs de upload são hexadecimais de 32 caracteres (uuid4)
+PADRAO_UPLOAD_ID = re.compile(r'^[0-9a-f]{32}$')
+
+# Tamanho dos blocos copiados do corpo da requisição para o disco
+TAMANHO_BLOCO = 64 * 1024
+
+# Intervalo mínimo entre duas varreduras de uploads expirados
+INTERVALO_LIMPEZA = timedelta(minutes=10)
+
+
+class OffsetInvalidoError(Exception):
+    """Pedaço enviado fora da posição esperada; offset_atual indica onde retomar"""
+
+    def __init__(self, offset_atual):
+        super().__init__(f"Offset esperado: {offset_atual}")
+        self.offset_atual = offset_atual
+
+
+class UploadStore:
+    """
+    Arquivos de cada upload em um diretório próprio, manifesto no banco
+    Uploads sem atividade há mais de ttl são removidos; quota limita, em bytes,
+    o espaço ocupado por todos os uploads (None desativa o limite)
+    """
+
+    def __init__(self, base_dir='uploads', ttl=timedelta(hours=24), quota=None, database=None):
+        self.base_dir = base_dir
+        self.ttl = ttl
+        self.quota = quota
+        self.database = database or database_padrao
+        self._ultima_limpeza = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.base_dir, exist_ok=True)
+
+    def create(self):
+        """Cria o diretório de um novo upload e retorna seu ID"""
+        self._sweep_if_due()
+        upload_id = uuid.uuid4().hex
+        os.makedirs(self.upload_dir(upload_id))
+        return upload_id
+
+    def upload_dir(self, upload_id):
+        """Diretório de trabalho do upload"""
+        if not PADRAO_UPLOAD_ID.match(upload_id or ''):
+            raise ValueError(f"ID de upload inválido: {upload_id}")
+        return os.path.join(self.base_dir, upload_id)
+
+    def workspace_dir(self, upload_id):
+        """Diretório de arquivos temporários do upload, removido junto com ele"""
+        caminho = os.path.join(self.upload_dir(upload_id), 'workspace')
+        os.makedirs(caminho, exist_ok=True)
+        return caminho
+
+    def save(self, upload_id, manifesto):
+        """Grava o manifesto do upload, substituindo o anterior"""
+        self.upload_dir(upload_id)  # Valida o ID
+        manifesto = dict(manifesto, updated_at=datetime.now().isoformat())
+        with self.database.transacao() as conexao:
+            conexao.execute(
+                'INSERT OR REPLACE INTO manifestos (upload_id, dados, atualizado_em) VALUES (?, ?, ?)',
+                (upload_id, json.dumps(manifesto, ensure_ascii=False), time.time()))
+
+    def get(self, upload_id):
+        """Carrega o manifesto do upload ou None se não existir"""
+        linha = self.database.conexao().execute(
+            'SELECT dados FROM manifestos WHERE upload_id = ?', (upload_id,)).fetchone()
+        return json.loads(linha['dados']) if linha else None
+
+    def partial_path(self, upload_id):
+        """Arquivo que recebe os pedaços de um upload em partes"""
+        return os.path.join(self.upload_dir(upload_id), 'upload.part')
+
+    def received_bytes(self, upload_id):
+        """Quantidade de bytes já recebidos de um upload em partes"""
+        try:
+            return os.path.getsize(self.partial_path(upload_id))
+        except OSError:
+            return 0
+
+    def append_chunk(self, upload_id, offset, stream, limite):
+        """
+        Anexa o conteúdo de stream ao upload a partir de offset, em blocos
+        Lança OffsetInvalidoError se offset não for o fim do que já foi recebido
+        ou se outro pedaço do mesmo upload estiver sendo gravado
+        Retorna o novo offset
+        """
+        with open(self.partial_path(upload_id), 'ab') as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise OffsetInvalidoError(self.received_bytes(upload_id))
+
+            atual = f.seek(0, os.SEEK_END)
+            if offset != atual:
+                raise OffsetInvalidoError(atual)
+
+            while atual < limite:
+                bloco = stream.read(min(TAMANHO_BLOCO, limite - atual))
+                if not bloco:
+                    break
+                f.write(bloco)
+                atual += len(bloco)
+            f.flush()
+            return atual
+
+    def delete(self, upload_id):
+        """Remove o upload com todos os seus arquivos e o manifesto"""
+        try:
+            shutil.rmtree(self.upload_dir(upload_id), ignore_errors=True)
+        except ValueError:
+            return
+        with self.database.transacao() as conexao:
+            conexao.execute('DELETE FROM manifestos WHERE upload_id = ?', (upload_id,))
+
+    def _upload_ids(self):
+        """IDs de todos os uploads existentes no diretório base"""
+        with os.scandir(self.base_dir) as entradas:
+            return [e.name for e in entradas if e.is_dir() and PADRAO_UPLOAD_ID.match(e.name)]
+
+    def disk_usage(self, upload_id=None):
+        """Bytes ocupados por um upload, ou por todos quando upload_id é None"""
+        diretorios = [self.upload_dir(upload_id)] if upload_id else [
+            os.path.join(self.base_dir, i) for i in self._upload_ids()
+        ]
+        total = 0
+        for diretorio in diretorios:
+            for raiz, _, arquivos in os.walk(diretorio):
+                for nome in arquivos:
+                    try:
+                        total += os.path.getsize(os.path.join(raiz, nome))
+                    except OSError:
+                        pass  # Removido durante a contagem
+        return total
+
+    def last_activity(self, upload_id):
+        """Horário (timestamp) da última escrita no diretório ou no manifesto do upload"""
+        diretorio = self.upload_dir(upload_id)
+        linha = self.database.conexao().execute(
+            'SELECT atualizado_em FROM manifestos WHERE upload_id = ?', (upload_id,)).fetchone()
+        manifesto = linha['atualizado_em'] if linha else 0
+        try:
+            with os.scandir(diretorio) as entradas:
+                return max([manifesto, os.stat(diretorio).st_mtime] + [e.stat().st_mtime for e in entradas])
+        except OSError:
+            return manifesto
+
+    def sweep(self):
+        """Remove os uploads sem atividade há mais que ttl; retorna quantos foram removidos"""
+        limite = time.time() - self.ttl.total_seconds()
+        expirados = [i for i in self._upload_ids() if self.last_activity(i) < limite]
+        for upload_id in expirados:
+            self.delete(upload_id)
+        # Manifestos antigos cujo diretório já não existe
+        orfaos = self.database.conexao().execute(
+            'SELECT upload_id FROM manifestos WHERE atualizado_em < ?', (limite,)).fetchall()
+        for linha in orfaos:
+            if not os.path.isdir(os.path.join(self.base_dir, linha['upload_id'])):
+                self.delete(linha['upload_id'])
+        self._ultima_limpeza = time.monotonic()
+        return len(expirados)
+
+    def _sweep_if_due(self):
+        """Executa sweep() no máximo uma vez a cada INTERVALO_LIMPEZA"""
+        with self._lock:
+            if time.monotonic() - self._ultima_limpeza < INTERVALO_LIMPEZA.total_seconds():
+                return
+            self._ultima_limpeza = time.monotonic()
+        self.sweep()
+
+    def has_space(self, tamanho):
+        """Verifica se a quota comporta mais tamanho bytes, removendo antes os expirados"""
+        if self.quota is None:
+            return True
+        if self.disk_usage() + tamanho <= self.quota:
+            return True
+        self.sweep()
+        return self.disk_usage() + tamanho <= self.quota
+
+
+# Instância global do armazenamento de uploads
+upload_store = UploadStore(
+    ttl=timedelta(hours=float(os.environ.get('UPLOAD_TTL_HOURS', 24))),
+    quota=int(os.environ.get('UPLOAD_QUOTA_MB', 10 * 1024)) * 1024 * 1024
+)
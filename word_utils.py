@@ -1,12 +1,24 @@
 import os
+import re
 import zipfile
 import tempfile
 import shutil
 from datetime import datetime
-from docx import Document
 from docx.shared import Cm, Pt
 from docx.enum.text import WD_PARAGRAPH_ALIGNMENT, WD_BREAK
-from PIL import Image, UnidentifiedImageError
+from docx.image.image import Image as ImagemDocx
+from docx.image.jpeg import Jpeg
+from docx.image.png import Png
+from docx.opc.constants import RELATIONSHIP_TYPE as RT
+from docx.opc.packuri import PackURI
+from docx.oxml.ns import qn
+from docx.oxml.shape import CT_Inline
+from docx.text.paragraph import Paragraph
+from image_utils import preparar_imagens, analisar_imagens, EXTENSAO_MINIATURA, DPI_PADRAO, QUALIDADE_JPEG_PADRAO, ERROS_MEMBRO_ZIP
+from template_cache import template_cache, paragrafos_com_placeholders, MARCADOR_INSERCAO
+from metrics import Cronometro, ESTAGIO_SEGUNDOS, IMAGENS, BYTES
+from docx_streaming import ParteImagemEmDisco, salvar_documento
+from metadados_imagem import ler_metadados, metadados_arquivo
 
 # Folder processing order as specified
 ORDEM_PASTAS = [
@@ -20,18 +32,321 @@ ORDEM_PASTAS = [
 # Folders that should use normal text with bold instead of headings
 PASTAS_TEXTO_NORMAL = ["- Detalhes", "- Vista ampla"]
 
-def processar_zip(zip_path, dados_formulario):
+# Display height of every image in the report
+ALTURA_IMAGEM_CM = 10
+
+# Differing dHash bits (out of 64) up to which two photos are flagged as near-duplicates
+LIMIAR_QUASE_DUPLICATA = 6
+
+# dHashes with fewer set (or unset) bits than this come from photos with almost no
+# horizontal detail (uniform, very dark, overexposed, flat sky) and match each other
+MINIMO_BITS_DHASH = 8
+
+# Image extensions accepted inside the ZIP
+EXTENSOES_IMAGEM = ('.png', '.jpg', '.jpeg')
+
+# Compression methods the zipfile module can read
+METODOS_COMPRESSAO = (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED, zipfile.ZIP_BZIP2, zipfile.ZIP_LZMA)
+
+# Image ordering policies inside a folder, with the labels shown on the settings page
+POLITICAS_ORDENACAO = {
+    'captura': 'Data da foto (EXIF), depois data no ZIP e nome',
+    'nome': 'Nome do arquivo',
+    'zip': 'Ordem no arquivo ZIP',
+}
+
+# Policy used by folders without one of their own
+ORDENACAO_PADRAO = {'padrao': 'captura', 'pastas': {}}
+
+# ZIP entry time written by tools that do not record one (DOS epoch)
+DATA_ZIP_VAZIA = (1980, 1, 1, 0, 0, 0)
+
+# python-docx image headers for the formats read by metadados_imagem
+CABECALHOS_DOCX = {'JPEG': Jpeg, 'PNG': Png}
+
+def largura_exibicao_cm(largura_px, altura_px, altura_cm=ALTURA_IMAGEM_CM):
+    """Width in the report of an image shown altura_cm tall, keeping its proportions"""
+    return altura_cm * largura_px / altura_px
+
+def _imagem_docx(dados):
+    """
+    python-docx Image for prepared bytes, built from the header read by
+    metadados_imagem instead of parsing it again with python-docx
+    """
+    metadados = ler_metadados(dados)
+    if metadados is None:
+        return ImagemDocx.from_blob(dados)
+    cabecalho = CABECALHOS_DOCX[metadados.formato](metadados.largura, metadados.altura, *metadados.dpi)
+    return ImagemDocx(dados, f"image.{cabecalho.default_ext}", cabecalho)
+
+def _chave_ordem_pasta(nome):
+    """Sort key placing known folders in ORDEM_PASTAS order"""
+    return (ORDEM_PASTAS.index(nome) if nome in ORDEM_PASTAS else len(ORDEM_PASTAS), nome)
+
+def _titulo_pasta(nome, nivel):
+    """Build folder title with hierarchy markers"""
+    if nivel == 0:
+        return nome
+    elif nivel == 1:
+        return f"»{nome}"
+    elif nivel == 2:
+        return f"»»{nome}"
+    return f"»»»{nome}"
+
+def _data_zip(info):
+    """ZIP entry time in ISO 8601, or None when the archive did not record one"""
+    if tuple(info.date_time) <= DATA_ZIP_VAZIA:
+        return None
+    try:
+        return datetime(*info.date_time).isoformat()
+    except ValueError:
+        return None
+
+def _chave_natural(caminho):
+    """Natural sort key of a file name: IMG_2 before IMG_10, ignoring case"""
+    return [int(parte) if parte.isdigit() else parte.casefold()
+            for parte in re.split(r'(\d+)', os.path.basename(caminho))]
+
+def _nome_inseguro(nome):
+    """Check whether a ZIP entry name is absolute or escapes the extraction folder"""
+    partes = re.split(r'[\\/]', nome)
+    return ('\x00' in nome or nome.startswith(('/', '\\'))
+            or re.match(r'^[A-Za-z]:', nome) is not None or '..' in partes)
+
+def validar_zip(zip_path):
+    """
+    Cheap up-front validation of an uploaded ZIP
+    Only the central directory is read: no member is decompressed, so CRCs are
+    checked later by the pass that reads each image (see processar_zip)
+    Raises zipfile.BadZipFile describing the first problem found
+    """
+    tamanho = os.path.getsize(zip_path)
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        infos = zip_ref.infolist()
+    
+    if not infos:
+        raise zipfile.BadZipFile("ZIP file is empty")
+    
+    for info in infos:
+        if _nome_inseguro(info.filename):
+            raise zipfile.BadZipFile(f"Invalid entry name: {info.filename}")
+        if info.flag_bits & 0x1:
+            raise zipfile.BadZipFile(f"Encrypted entry: {info.filename}")
+        if info.compress_type not in METODOS_COMPRESSAO:
+            raise zipfile.BadZipFile(f"Unsupported compression method in entry: {info.filename}")
+        if info.header_offset + info.compress_size > tamanho:
+            raise zipfile.BadZipFile(f"Truncated entry: {info.filename}")
+
+def processar_zip(zip_path, dados_formulario, streaming=False, pasta_miniaturas=None, workers=1,
+                  pasta_trabalho=None, deduplicar=False, cache=None, previas=None, ordenacao=None):
     """
     Extract ZIP file and organize folder structure
     Returns structured content list for Word document insertion
+
+    With streaming=True nothing is extracted: the structure is built from the
+    ZIP central directory and image items reference the archive member, whose
+    bytes are only read when the Word document is assembled.
+    Otherwise images are extracted into pasta_trabalho, which is then
+    required, under unique names, and the caller removes it.
+    With pasta_miniaturas, a preview thumbnail is written there for every image
+    (see image_utils.analisar_imagens), using workers processes.
+    With deduplicar, exact duplicate images are dropped and near-duplicates
+    flagged (see _deduplicar_imagens), from the hashes of that same pass.
+    cache (a blob_cache.BlobCache) lets that pass reuse earlier thumbnails.
+    previas holds results of that pass computed while the ZIP was still being
+    received (see ingestao_zip.IngestaoZip.resultados); in streaming mode they
+    replace reading the members whose central directory entry they match.
+    Images inside each folder are then ordered as ordenacao says (see
+    ordenar_imagens), using the capture times read by that same pass.
+
+    Member CRCs are verified by the pass that reads the bytes (extraction or
+    image analysis); image items whose member is damaged get an "erro" message.
     """
+    if not streaming and not pasta_trabalho:
+        raise ValueError("pasta_trabalho is required to extract the ZIP")
+    
     print(f"Processing ZIP file: {zip_path}")
+    cronometro = Cronometro(ESTAGIO_SEGUNDOS)
+    
+    with cronometro.medir('zip_estrutura'):
+        if streaming:
+            conteudo, datas_zip = _processar_zip_streaming(zip_path)
+        else:
+            conteudo, datas_zip = _processar_zip_extraido(zip_path, pasta_trabalho)
+    
+    itens_imagem = [item for item in conteudo if isinstance(item, dict) and 'imagem' in item]
+    IMAGENS.inc(len(itens_imagem), resultado='encontrada')
+    
+    if pasta_miniaturas or deduplicar:
+        previas = _previas_conferidas(zip_path, previas) if streaming and previas else None
+        if previas:
+            IMAGENS.inc(len(previas), resultado='analisada_no_envio')
+        with cronometro.medir('analise_imagens'):
+            analisar_imagens(itens_imagem, pasta_miniaturas, workers=workers, cache=cache, previas=previas)
+        IMAGENS.inc(sum(1 for item in itens_imagem if item.get('erro')), resultado='corrompida')
+    
+    # Before deduplication, so the earliest copy of a repeated photo is the one kept
+    with cronometro.medir('ordenacao'):
+        conteudo = ordenar_imagens(conteudo, ordenacao, datas_zip)
+    
+    if deduplicar:
+        with cronometro.medir('deduplicacao'):
+            conteudo = _deduplicar_imagens(conteudo, pasta_miniaturas)
+        IMAGENS.inc(sum(len(item.get('duplicatas', ())) for item in itens_imagem), resultado='duplicada')
+    
+    cronometro.registrar()
+    return conteudo
+
+def ordenar_imagens(conteudo, ordenacao=None, datas_zip=None):
+    """
+    Reorder the images of each folder section by the folder's policy
+    ordenacao is {'padrao': policy, 'pastas': {folder name: policy}} with
+    policies from POLITICAS_ORDENACAO (ORDENACAO_PADRAO when None):
+    - captura: EXIF DateTimeOriginal, else the ZIP entry time (datas_zip maps
+      item["imagem"] to it), else nothing; ties and photos without any time
+      follow the natural file name order, the latter after the dated ones
+    - nome: natural file name order
+    - zip: archive order, as the content was built
+    Capture times come from item["captura"], set by the analysis pass; items
+    that pass did not read (no sha256) get it from their header alone
+    """
+    ordenacao = ordenacao or ORDENACAO_PADRAO
+    datas_zip = datas_zip or {}
+    arquivos_zip = {}
+    
+    def chave_captura(item):
+        if 'captura' not in item and 'sha256' not in item and not item.get('erro'):
+            if item.get('zip_path'):
+                metadados = metadados_arquivo(item['zip_path'], item['imagem'], arquivos_zip)
+            else:
+                metadados = metadados_arquivo(item['imagem'])
+            item['captura'] = metadados.captura if metadados else None
+        instante = item.get('captura') or datas_zip.get(item['imagem'])
+        return (instante is None, instante or '', _chave_natural(item['imagem']))
+    
+    chaves = {
+        'captura': chave_captura,
+        'nome': lambda item: _chave_natural(item['imagem']),
+    }
+    
+    resultado = []
+    secao = []
+    chave = None
+    try:
+        for item in conteudo + [None]:
+            if isinstance(item, dict) and 'imagem' in item:
+                secao.append(item)
+                continue
+            if secao:
+                resultado.extend(sorted(secao, key=chave) if chave else secao)
+                secao = []
+            if isinstance(item, str):
+                politica = ordenacao['pastas'].get(item.lstrip('»'), ordenacao['padrao'])
+                chave = chaves.get(politica)
+            if item is not None:
+                resultado.append(item)
+    finally:
+        for zip_ref in arquivos_zip.values():
+            zip_ref.close()
+    return resultado
+
+def _previas_conferidas(zip_path, previas):
+    """
+    Keep the earlier results whose member still has the same local header
+    offset, CRC and compressed size in the central directory, keyed by name
+    """
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        infos = zip_ref.infolist()
+    conferidas = {}
+    for info in infos:
+        previa = previas.get(info.filename)
+        if previa and (previa['cabecalho'], previa['crc'], previa['tamanho_comprimido']) == \
+                (info.header_offset, info.CRC, info.compress_size):
+            conferidas[info.filename] = previa['resultado']
+    return conferidas
+
+def _deduplicar_imagens(conteudo, pasta_miniaturas=None):
+    """
+    Drop images whose bytes (sha256) repeat an earlier image, listing them in
+    the kept item's "duplicatas", and mark images whose dHash differs from an
+    earlier one by at most LIMIAR_QUASE_DUPLICATA bits with "semelhante_a"
+    Dropped images lose their workspace copy and their thumbnail in pasta_miniaturas;
+    dHashes with less than MINIMO_BITS_DHASH bits of detail are not compared
+    """
+    mantidas = {}
+    resultado = []
+    imagens_na_secao = 0
+    for item in conteudo:
+        if isinstance(item, dict) and item.get('sha256') in mantidas:
+            original = mantidas[item['sha256']]
+            original.setdefault('duplicatas', []).append(item['imagem'])
+            print(f"Duplicate image skipped: {item['imagem']} (same as {original['imagem']})")
+            descartados = [] if item.get('zip_path') else [item['imagem']]
+            if pasta_miniaturas and 'miniatura' in item:
+                descartados.append(os.path.join(pasta_miniaturas, f"{item['miniatura']}{EXTENSAO_MINIATURA}"))
+            for caminho in descartados:
+                try:
+                    os.remove(caminho)
+                except OSError:
+                    pass
+            continue
+        
+        if isinstance(item, dict) and 'imagem' in item:
+            if item.get('sha256'):
+                mantidas[item['sha256']] = item
+            imagens_na_secao += 1
+        elif isinstance(item, dict) and 'quebra_pagina' in item:
+            # A section left without images keeps no page break, as on extraction
+            if not imagens_na_secao:
+                continue
+            imagens_na_secao = 0
+        else:
+            imagens_na_secao = 0
+        resultado.append(item)
+    
+    # Candidates share at least one byte of the hash: with 8 bands, any pair
+    # differing in fewer than 8 bits is found without comparing every pair
+    faixas = [{} for _ in range(8)]
+    for item in resultado:
+        if not (isinstance(item, dict) and item.get('dhash')):
+            continue
+        valor = int(item['dhash'], 16)
+        if not MINIMO_BITS_DHASH <= bin(valor).count('1') <= 64 - MINIMO_BITS_DHASH:
+            continue
+        candidatos = []
+        for n, faixa in enumerate(faixas):
+            chave = (valor >> (8 * n)) & 0xFF
+            candidatos.extend(faixa.get(chave, ()))
+            faixa.setdefault(chave, []).append((valor, item))
+        semelhantes = [outro for outro_valor, outro in candidatos
+                       if bin(valor ^ outro_valor).count('1') <= LIMIAR_QUASE_DUPLICATA]
+        if semelhantes:
+            item['semelhante_a'] = semelhantes[0]['imagem']
+    
+    return resultado
+
+def _processar_zip_extraido(zip_path, pasta_trabalho):
+    """
+    Extract the whole ZIP inside pasta_trabalho and walk the extracted tree
+    Returns the content list and the ZIP entry time of each extracted image
+    """
+    pasta_imagens = os.path.join(pasta_trabalho, 'imagens')
+    os.makedirs(pasta_imagens, exist_ok=True)
     
     # Create temporary directory for extraction
-    with tempfile.TemporaryDirectory() as temp_dir:
-        # Extract ZIP file
+    with tempfile.TemporaryDirectory(dir=pasta_trabalho) as temp_dir:
+        # Extract ZIP file member by member, keeping the damaged ones reported
+        erros = {}
+        entradas = {}  # Extracted path -> (position in the archive, entry time)
         with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-            zip_ref.extractall(temp_dir)
+            for posicao, info in enumerate(zip_ref.infolist()):
+                destino = os.path.normpath(os.path.join(temp_dir, info.filename))
+                entradas[destino] = (posicao, _data_zip(info))
+                try:
+                    zip_ref.extract(info, temp_dir)
+                except ERROS_MEMBRO_ZIP as e:
+                    print(f"Error: Corrupted file in ZIP: {info.filename} ({e})")
+                    erros[destino] = f"Corrupted file in ZIP: {info.filename} ({e})"
         
         # Find the root folder (should be the only folder in temp_dir)
         extracted_items = os.listdir(temp_dir)
@@ -42,12 +357,13 @@ def processar_zip(zip_path, dados_formulario):
         
         # Process folder structure
         conteudo = []
+        datas_zip = {}
         
         # Walk through directory structure
         for root, dirs, files in os.walk(pasta_raiz):
             # Sort directories according to specified order
             if root == pasta_raiz:
-                dirs.sort(key=lambda x: (ORDEM_PASTAS.index(x) if x in ORDEM_PASTAS else len(ORDEM_PASTAS), x))
+                dirs.sort(key=_chave_ordem_pasta)
             
             # Calculate relative path and hierarchy level
             rel_path = os.path.relpath(root, pasta_raiz)
@@ -59,41 +375,136 @@ def processar_zip(zip_path, dados_formulario):
             
             # Add folder title based on hierarchy level
             folder_name = path_parts[-1]
-            if nivel == 0:
-                conteudo.append(folder_name)
-            elif nivel == 1:
-                conteudo.append(f"»{folder_name}")
-            elif nivel == 2:
-                conteudo.append(f"»»{folder_name}")
-            else:
-                conteudo.append(f"»»»{folder_name}")
+            conteudo.append(_titulo_pasta(folder_name, nivel))
             
             # Process images in current folder
             arquivos_imagens = [
                 os.path.join(root, file)
                 for file in files
-                if file.lower().endswith(('.png', '.jpg', '.jpeg'))
+                if file.lower().endswith(EXTENSOES_IMAGEM)
             ]
             
-            # Sort images by creation time
-            arquivos_imagens.sort(key=lambda x: os.path.getctime(x) if os.path.exists(x) else 0)
+            # Archive order, as in streaming mode; ordenar_imagens applies the folder policy
+            arquivos_imagens.sort(key=lambda x: entradas.get(os.path.normpath(x), (len(entradas), None))[0])
             
             # Add images to content
             for imagem_path in arquivos_imagens:
-                # Copy image to temporary location for processing
-                temp_image_path = os.path.join(tempfile.gettempdir(), f"temp_img_{os.path.basename(imagem_path)}")
-                shutil.copy2(imagem_path, temp_image_path)
-                conteudo.append({"imagem": temp_image_path})
+                # Keep the image in the workspace under its own name; one folder per position avoids clashes
+                pasta_item = os.path.join(pasta_imagens, f"{len(conteudo):05d}")
+                os.makedirs(pasta_item)
+                temp_image_path = os.path.join(pasta_item, os.path.basename(imagem_path))
+                shutil.move(imagem_path, temp_image_path)
+                item = {"imagem": temp_image_path}
+                if os.path.normpath(imagem_path) in erros:
+                    item["erro"] = erros[os.path.normpath(imagem_path)]
+                conteudo.append(item)
+                datas_zip[temp_image_path] = entradas.get(os.path.normpath(imagem_path), (0, None))[1]
             
             # Add page break after each folder section
             if arquivos_imagens:  # Only add page break if there were images
                 conteudo.append({"quebra_pagina": True})
         
-        return conteudo
+        return conteudo, datas_zip
+
+def _montar_arvore_zip(infos):
+    """Build a nested folder tree from ZIP entries without extracting them"""
+    raiz = {'pastas': {}, 'arquivos': []}
+    for info in infos:
+        partes = [parte for parte in info.filename.split('/') if parte]
+        if not partes:
+            continue
+        if info.is_dir():
+            pastas, nome_arquivo = partes, None
+        else:
+            pastas, nome_arquivo = partes[:-1], info
+        
+        no = raiz
+        for parte in pastas:
+            no = no['pastas'].setdefault(parte, {'pastas': {}, 'arquivos': []})
+        if nome_arquivo is not None:
+            no['arquivos'].append(nome_arquivo)
+    return raiz
 
-def substituir_placeholders(doc, dados_formulario, placeholders):
+def _percorrer_arvore_zip(no, zip_path, conteudo, datas_zip, nivel=0):
+    """
+    Walk the ZIP tree top-down, mirroring the os.walk order of extraction mode
+    The entry time of each image goes to datas_zip, keyed by member name
+    """
+    nomes = list(no['pastas'])
+    if nivel == 0:
+        nomes.sort(key=_chave_ordem_pasta)
+    
+    for nome in nomes:
+        pasta = no['pastas'][nome]
+        conteudo.append(_titulo_pasta(nome, nivel))
+        
+        # Images keep the archive order, which is the extraction order
+        imagens = [
+            info for info in pasta['arquivos']
+            if info.filename.lower().endswith(EXTENSOES_IMAGEM)
+        ]
+        for info in imagens:
+            conteudo.append({"imagem": info.filename, "zip_path": zip_path})
+            datas_zip[info.filename] = _data_zip(info)
+        
+        if imagens:
+            conteudo.append({"quebra_pagina": True})
+        
+        _percorrer_arvore_zip(pasta, zip_path, conteudo, datas_zip, nivel + 1)
+
+def _processar_zip_streaming(zip_path):
+    """
+    Build the content list straight from ZipFile.infolist()
+    Returns it with the ZIP entry time of each image, by member name
+    """
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        arvore = _montar_arvore_zip(zip_ref.infolist())
+    
+    # Skip the root folder when it is the only entry, as extraction mode does
+    if not arvore['arquivos'] and len(arvore['pastas']) == 1:
+        arvore = next(iter(arvore['pastas'].values()))
+    
+    conteudo = []
+    datas_zip = {}
+    _percorrer_arvore_zip(arvore, zip_path, conteudo, datas_zip)
+    return conteudo, datas_zip
+
+# Compiled alternation regex per placeholder key set
+_padroes_placeholders = {}
+
+# Run children that are not text and must survive a placeholder rewrite
+_CONTEUDO_PRESERVADO = {qn('w:rPr'), qn('w:drawing'), qn('w:pict'), qn('w:object'),
+                        qn('w:fldChar'), qn('w:instrText'),
+                        '{http://schemas.openxmlformats.org/markup-compatibility/2006}AlternateContent'}
+
+def _padrao_placeholders(chaves):
+    """Return one compiled regex matching any of the placeholder keys"""
+    chave = tuple(sorted(chaves))
+    padrao = _padroes_placeholders.get(chave)
+    if padrao is None:
+        # Longest first so no key can shadow a longer one
+        alternativas = sorted(chave, key=len, reverse=True)
+        padrao = re.compile('|'.join(re.escape(c) for c in alternativas))
+        _padroes_placeholders[chave] = padrao
+    return padrao
+
+def _limpar_texto_paragrafo(paragraph):
+    """Remove the text of every run, keeping pictures, text boxes and fields"""
+    for r in paragraph._p.xpath('./w:r | ./w:hyperlink/w:r'):
+        for filho in list(r):
+            if filho.tag not in _CONTEUDO_PRESERVADO:
+                r.remove(filho)
+
+def substituir_placeholders(doc, dados_formulario, placeholders, paragrafos=None):
     """
     Replace placeholders in Word document with form data and apply specific formatting
+    Returns the placeholders that were never found in the document; those
+    found but without form data are left as they are and reported apart
+    
+    Each paragraph is tokenized once against a single regex of all keys. By
+    default the body, tables, nested tables, text boxes, headers and footers
+    are scanned; paragrafos restricts the scan to paragraphs already known to
+    hold placeholders, as recorded by the template cache.
     """
     print("Replacing placeholders in document...")
     
@@ -101,52 +512,53 @@ def substituir_placeholders(doc, dados_formulario, placeholders):
     placeholder_data = {}
     for placeholder, form_field in placeholders.items():
         if form_field in dados_formulario:
-            placeholder_data[placeholder] = dados_formulario[form_field]
+            placeholder_data[placeholder] = str(dados_formulario[form_field])
         elif form_field == 'Ygor Augusto Fernandes':
             placeholder_data[placeholder] = 'Ygor Augusto Fernandes'
         elif form_field == 'MAFFENG - Engenharia e Manutenção Profissional':
             placeholder_data[placeholder] = 'MAFFENG - Engenharia e Manutenção Profissional'
     
-    # Replace placeholders in paragraphs with specific formatting
-    for paragraph in doc.paragraphs:
-        for placeholder, value in placeholder_data.items():
-            if placeholder in paragraph.text:
-                # Replace text preserving existing formatting and structure
-                text_with_replacement = paragraph.text.replace(placeholder, str(value))
-                
-                # Clear runs but preserve paragraph structure
-                for run in paragraph.runs:
-                    run.clear()
-                
-                # Add new run with proper formatting
-                run = paragraph.add_run(text_with_replacement)
-                aplicar_estilo_placeholder(run, placeholder)
-                
-                # Ensure no hyperlink formatting is applied
-                run.font.underline = False
-    
-    # Replace placeholders in tables with specific formatting
-    for table in doc.tables:
-        for row in table.rows:
-            for cell in row.cells:
-                for paragraph in cell.paragraphs:
-                    for placeholder, value in placeholder_data.items():
-                        if placeholder in paragraph.text:
-                            # Replace text preserving existing formatting and structure
-                            text_with_replacement = paragraph.text.replace(placeholder, str(value))
-                            
-                            # Clear runs but preserve paragraph structure
-                            for run in paragraph.runs:
-                                run.clear()
-                            
-                            # Add new run with proper formatting
-                            run = paragraph.add_run(text_with_replacement)
-                            aplicar_estilo_placeholder(run, placeholder)
-                            
-                            # Ensure no hyperlink formatting is applied
-                            run.font.underline = False
-    
-    print(f"Replaced {len(placeholder_data)} placeholders")
+    if paragrafos is None:
+        paragrafos = [Paragraph(p, None) for parte, p in paragrafos_com_placeholders(doc)]
+    
+    encontrados = set()
+    substituidos = set()
+    if placeholders:
+        # Every key is matched, so keys without data are still seen in the document
+        padrao = _padrao_placeholders(placeholders)
+        ordem = list(placeholder_data)
+        
+        for paragraph in paragrafos:
+            texto = paragraph.text
+            no_paragrafo = set(padrao.findall(texto))
+            encontrados |= no_paragrafo
+            com_dados = no_paragrafo & placeholder_data.keys()
+            if not com_dados:
+                continue
+            substituidos |= com_dados
+            text_with_replacement = padrao.sub(lambda m: placeholder_data.get(m.group(0), m.group(0)), texto)
+            
+            # Clear run text but preserve paragraph structure
+            _limpar_texto_paragrafo(paragraph)
+            
+            # Add new run with the style of the last placeholder, in mapping order
+            run = paragraph.add_run(text_with_replacement)
+            aplicar_estilo_placeholder(run, max(com_dados, key=ordem.index))
+            
+            # Ensure no hyperlink formatting is applied
+            run.font.underline = False
+    
+    nao_encontrados = [placeholder for placeholder in placeholders if placeholder not in encontrados]
+    if nao_encontrados:
+        print(f"Warning: placeholders not found in template: {', '.join(nao_encontrados)}")
+    
+    sem_dados = [placeholder for placeholder in placeholders
+                 if placeholder in encontrados and placeholder not in placeholder_data]
+    if sem_dados:
+        print(f"Warning: placeholders left unfilled, no form data: {', '.join(sem_dados)}")
+    
+    print(f"Replaced {len(substituidos)} of {len(placeholder_data)} placeholders")
+    return nao_encontrados
 
 def aplicar_estilo(run, tamanho, negrito=False, fonte="Arial"):
     """Apply font styling to text run"""
@@ -188,116 +600,220 @@ def aplicar_estilo_placeholder(run, placeholder):
         run.font.size = Pt(11)
         run.font.color.rgb = None  # Remove any color formatting
 
-def inserir_conteudo_word(modelo_path, conteudo, placeholders, dados_formulario, output_path):
+class _MontadorDocumento:
+    """
+    Append paragraphs and pictures before a fixed anchor in constant time
+    
+    python-docx rescans the whole document on every doc.paragraphs access and,
+    inside add_picture, for the next shape id, the image SHA1s and the next
+    relationship id. Here that state is collected once and kept up to date.
+    New image parts are written to pasta_midia and only referenced from the
+    package, so their bytes are not held in memory until the document is saved.
+    """
+    
+    def __init__(self, doc, ancora, pasta_midia):
+        self.doc = doc
+        self.ancora = ancora
+        self.pasta_midia = pasta_midia
+        self.parte = doc.part
+        self.pacote = doc.part.package
+        
+        ids = [int(i) for i in self.parte.element.xpath('//@id') if i.isdigit()]
+        self.proximo_id = max(ids, default=0) + 1
+        
+        numeros_imagem = [
+            parte.partname.idx for parte in self.pacote.iter_parts()
+            if parte.partname.startswith('/word/media/image') and parte.partname.idx
+        ]
+        self.proximo_numero_imagem = max(numeros_imagem, default=0) + 1
+        
+        numeros_rid = [int(rId[3:]) for rId in self.parte.rels if rId[3:].isdigit()]
+        self.proximo_rid = max(numeros_rid, default=0) + 1
+        
+        self.partes_por_sha1 = {parte.sha1: parte for parte in self.pacote.image_parts}
+        self.rids_por_sha1 = {}
+    
+    def novo_paragrafo(self):
+        """Insert an empty paragraph right before the anchor"""
+        return self.ancora.insert_paragraph_before('')
+    
+    def _relacionar(self, parte_imagem):
+        """
+        rId of the body relationship to parte_imagem, added when missing
+        Every new rId comes from proximo_rid, so an image of the template used
+        only by a header or footer cannot take an rId given to a later image
+        """
+        for rId, rel in self.parte.rels.items():
+            if not rel.is_external and rel.reltype == RT.IMAGE and rel.target_part is parte_imagem:
+                return rId
+        rId = 'rId%d' % self.proximo_rid
+        self.proximo_rid += 1
+        self.parte.rels.add_relationship(RT.IMAGE, parte_imagem, rId)
+        return rId
+    
+    def adicionar_imagem(self, run, dados, largura, altura):
+        """Add picture bytes to run, reusing the image part of identical bytes"""
+        imagem = _imagem_docx(dados)
+        sha1 = imagem.sha1
+        
+        rId = self.rids_por_sha1.get(sha1)
+        if rId is None:
+            parte_imagem = self.partes_por_sha1.get(sha1)
+            if parte_imagem is None:
+                partname = PackURI('/word/media/image%d.%s' % (self.proximo_numero_imagem, imagem.ext))
+                self.proximo_numero_imagem += 1
+                parte_imagem = ParteImagemEmDisco.gravar(partname, imagem, self.pasta_midia)
+                self.pacote.image_parts.append(parte_imagem)
+                self.partes_por_sha1[sha1] = parte_imagem
+            rId = self._relacionar(parte_imagem)
+            self.rids_por_sha1[sha1] = rId
+        
+        cx, cy = imagem.scaled_dimensions(largura, altura)
+        inline = CT_Inline.new_pic_inline(self.proximo_id, rId, imagem.filename, cx, cy)
+        self.proximo_id += 1
+        run._r.add_drawing(inline)
+
+def inserir_conteudo_word(modelo_path, conteudo, placeholders, dados_formulario, output_path, progresso=None,
+                          dpi=DPI_PADRAO, qualidade_jpeg=QUALIDADE_JPEG_PADRAO, workers=1, cache=None,
+                          pasta_trabalho=None):
     """
     Insert content into Word template and generate final document
     Returns number of images inserted
+    
+    progresso, when given, is called as progresso(processed, total) after each image
+    Images are resampled to dpi for their display height and re-encoded with
+    qualidade_jpeg before embedding; dpi=None embeds them at full resolution.
+    Preparation runs on a pool of workers processes ahead of the assembly loop.
+    With cache (a blob_cache.BlobCache), images prepared by earlier reports
+    with the same settings are reused instead of being decoded again.
+    Embedded images wait in a temporary folder (inside pasta_trabalho, when
+    given) and are streamed into the output one at a time, so memory does not
+    grow with the number of photos.
     """
     print(f"Loading Word template: {modelo_path}")
+    cronometro = Cronometro(ESTAGIO_SEGUNDOS)
     
-    # Load Word document
-    doc = Document(modelo_path)
+    # Copy of the parsed template, with placeholder paragraphs and insertion point located
+    with cronometro.medir('carregar_modelo'):
+        doc, paragrafos_placeholder, ancora = template_cache.obter(modelo_path)
     contador_imagens = 0
     
     # Replace placeholders first
-    substituir_placeholders(doc, dados_formulario, placeholders)
-    
-    # Find insertion point
-    paragrafo_insercao_index = None
-    for i, paragrafo in enumerate(doc.paragraphs):
-        if "{{start_here}}" in paragrafo.text:
-            paragrafo_insercao_index = i
-            # Clear the start_here marker
-            paragrafo.text = paragrafo.text.replace("{{start_here}}", "")
-            break
-    
-    if paragrafo_insercao_index is None:
+    with cronometro.medir('placeholders'):
+        substituir_placeholders(doc, dados_formulario, placeholders, paragrafos_placeholder)
+    
+    if ancora is not None:
+        # Clear the start_here marker
+        ancora.text = ancora.text.replace(MARCADOR_INSERCAO, "")
+    else:
         print("Warning: '{{start_here}}' marker not found in template")
         # Use last paragraph as insertion point
-        paragrafo_insercao_index = len(doc.paragraphs) - 1
-    
-    # Insert content in reverse order to maintain proper positioning
-    conteudo_invertido = list(reversed(conteudo))
-    
-    for item in conteudo_invertido:
-        if isinstance(item, str):
-            # Process folder titles
-            titulo_limpo = item.replace("»", "").strip()
-            # Remove duplicate hyphens if they exist
-            if titulo_limpo.startswith("- -"):
-                titulo_limpo = titulo_limpo[2:].strip()
-            titulo = titulo_limpo + ":"
-            nivel = item.count("»")
+        ancora = doc.paragraphs[-1]
+    
+    # Content is inserted in order, each new element right before the anchor
+    pasta_midia = tempfile.mkdtemp(prefix='midia_', dir=pasta_trabalho)
+    montador = _MontadorDocumento(doc, ancora, pasta_midia)
+    try:
+        # Decode, orient and downscale every image up front, in insertion order
+        itens_imagem = [item for item in conteudo if isinstance(item, dict) and 'imagem' in item]
+        imagens_preparadas = preparar_imagens(itens_imagem, ALTURA_IMAGEM_CM, dpi, qualidade_jpeg, workers, cache)
+    
+        # Progress reporting counts every image item, inserted or not
+        total_imagens = len(itens_imagem)
+        imagens_processadas = 0
+        if progresso:
+            progresso(0, total_imagens)
+    
+        for item in conteudo:
+            if isinstance(item, str):
+                # Process folder titles
+                titulo_limpo = item.replace("»", "").strip()
+                # Remove duplicate hyphens if they exist
+                if titulo_limpo.startswith("- -"):
+                    titulo_limpo = titulo_limpo[2:].strip()
+                titulo = titulo_limpo + ":"
+                nivel = item.count("»")
             
-            # Insert new paragraph
-            p = doc.paragraphs[paragrafo_insercao_index].insert_paragraph_before('')
-            run = p.add_run(titulo)
+                # Insert new paragraph
+                p = montador.novo_paragrafo()
+                run = p.add_run(titulo)
             
-            # Apply styling based on folder type and hierarchy
-            if any(pasta in titulo for pasta in PASTAS_TEXTO_NORMAL):
-                aplicar_estilo(run, 11, negrito=True)
-                p.alignment = WD_PARAGRAPH_ALIGNMENT.JUSTIFY
-            elif nivel == 0:
-                p.style = 'Heading 1'
-            elif nivel == 1:
-                p.style = 'Heading 2'
-            elif nivel == 2:
-                p.style = 'Heading 3'
-            else:
-                aplicar_estilo(run, 12, negrito=True)
+                # Apply styling based on folder type and hierarchy
+                if any(pasta in titulo for pasta in PASTAS_TEXTO_NORMAL):
+                    aplicar_estilo(run, 11, negrito=True)
+                    p.alignment = WD_PARAGRAPH_ALIGNMENT.JUSTIFY
+                elif nivel == 0:
+                    p.style = 'Heading 1'
+                elif nivel == 1:
+                    p.style = 'Heading 2'
+                elif nivel == 2:
+                    p.style = 'Heading 3'
+                else:
+                    aplicar_estilo(run, 12, negrito=True)
         
-        elif isinstance(item, dict):
-            if 'imagem' in item:
-                # Process image insertion
-                imagem_path = item["imagem"]
-                if os.path.exists(imagem_path) and os.path.getsize(imagem_path) > 0:
-                    try:
-                        # Insert image paragraph
-                        p = doc.paragraphs[paragrafo_insercao_index].insert_paragraph_before('')
+            elif isinstance(item, dict):
+                if 'imagem' in item:
+                    # Process image insertion
+                    imagem_path = item["imagem"]
+                    # Time blocked here is decoding and resizing not yet done by the pool
+                    with cronometro.medir('preparar_imagens'):
+                        dados_imagem, largura_original, altura_original, erro = next(imagens_preparadas)
+                    if erro:
+                        print(erro)
+                        IMAGENS.inc(resultado='falha')
+                    else:
+                        try:
+                            # Blank spacing paragraph, then the image paragraph
+                            p_break = montador.novo_paragrafo()
+                            p = montador.novo_paragrafo()
+                            altura_desejada_cm = ALTURA_IMAGEM_CM  # Fixed height as specified
                         
-                        # Calculate image dimensions
-                        with Image.open(imagem_path) as img:
-                            largura_original, altura_original = img.size
-                            altura_desejada_cm = 10  # Fixed height as specified
-                            
                             # Calculate proportional width
-                            ratio = altura_desejada_cm / (altura_original / 28.35)  # Convert pixels to cm
-                            largura_proporcional_cm = (largura_original / 28.35) * ratio
-                            
+                            largura_proporcional_cm = largura_exibicao_cm(largura_original, altura_original,
+                                                                          altura_desejada_cm)
+                        
                             # Insert image
-                            run = p.add_run()
-                            run.add_picture(
-                                imagem_path,
-                                width=Cm(largura_proporcional_cm),
-                                height=Cm(altura_desejada_cm)
-                            )
+                            with cronometro.medir('inserir_xml'):
+                                run = p.add_run()
+                                montador.adicionar_imagem(
+                                    run,
+                                    dados_imagem,
+                                    Cm(largura_proporcional_cm),
+                                    Cm(altura_desejada_cm)
+                                )
                             p.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
                             contador_imagens += 1
-                            
-                            # Add single paragraph break after image for better spacing
-                            p_break = doc.paragraphs[paragrafo_insercao_index].insert_paragraph_before('')
+                            IMAGENS.inc(resultado='inserida')
+                            BYTES.inc(len(dados_imagem), tipo='imagem_embutida')
                         
-                        # Clean up temporary image file
-                        try:
-                            os.remove(imagem_path)
-                        except:
-                            pass  # Ignore cleanup errors
+                            # Clean up temporary image file (ZIP members are left untouched)
+                            if not item.get("zip_path"):
+                                try:
+                                    os.remove(imagem_path)
+                                except:
+                                    pass  # Ignore cleanup errors
                     
-                    except UnidentifiedImageError:
-                        print(f"Error: Unrecognized image format: {imagem_path}")
-                    except Exception as e:
-                        print(f"Error inserting image '{imagem_path}': {e}")
-                else:
-                    print(f"Error: Invalid image file: {imagem_path}")
+                        except Exception as e:
+                            print(f"Error inserting image '{imagem_path}': {e}")
+                            IMAGENS.inc(resultado='falha')
+                
+                    imagens_processadas += 1
+                    if progresso:
+                        progresso(imagens_processadas, total_imagens)
             
-            elif 'quebra_pagina' in item:
-                # Insert page break
-                p = doc.paragraphs[paragrafo_insercao_index].insert_paragraph_before('')
-                p.add_run().add_break(WD_BREAK.PAGE)
-    
-    # Save final document
-    print(f"Saving document to: {output_path}")
-    doc.save(output_path)
+                elif 'quebra_pagina' in item:
+                    # Insert page break
+                    p = montador.novo_paragrafo()
+                    p.add_run().add_break(WD_BREAK.PAGE)
+    
+        # Save final document
+        print(f"Saving document to: {output_path}")
+        with cronometro.medir('salvar_docx'):
+            salvar_documento(doc, output_path)
+    finally:
+        shutil.rmtree(pasta_midia, ignore_errors=True)
+    BYTES.inc(os.path.getsize(output_path), tipo='docx_gerado')
+    cronometro.registrar()
     
     print(f"Document created successfully with {contador_imagens} images")
     return contador_imagens